@@ -0,0 +1,73 @@
+"""
+Memory regression benchmark. Runs many small allocations, measuring and
+executing each of them, and checks that the resident set size reaches a
+steady state instead of growing with the number of allocations:
+
+  python benchmarks/allocation_memory.py -n 10000 --max-growth-mb 8
+
+"""
+import gc
+import os
+import sys
+import warnings
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quoll.config
+import quoll.boilerplate as bp
+from quoll.preamble import *
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss() -> int:
+  """Current resident set size in bytes."""
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * _PAGE_SIZE
+  except OSError:
+    import psutil
+    return psutil.Process().memory_info().rss
+
+def run_allocation(index: int):
+  with allocation(1, 2) as (control, targets):
+    H(control)
+    Controlled[X](control, targets[index % 2])
+    bp.execute(measure(control), measure(targets))
+
+def main(argv=None):
+  parser = ArgumentParser()
+  parser.add_argument('-n', '--allocations', type=int, default=10000, help='number of allocations after the warm-up.')
+  parser.add_argument('--warmup', type=int, default=1000, help='allocations run before taking the baseline.')
+  parser.add_argument('-b', '--backend', type=str, default='quoll:statevector', help='backend executing the circuits.')
+  parser.add_argument('--max-growth-mb', type=float, default=8, help='fails if RSS grows more than this after the warm-up.')
+  args = parser.parse_args(argv)
+
+  warnings.filterwarnings('ignore')
+  quoll.config.set_backend(args.backend)
+
+  for index in range(args.warmup):
+    run_allocation(index)
+  gc.collect()
+  baseline = rss()
+
+  checkpoints = 10
+  for checkpoint in range(checkpoints):
+    start = checkpoint * args.allocations // checkpoints
+    end = (checkpoint + 1) * args.allocations // checkpoints
+    for index in range(start, end):
+      run_allocation(index)
+    gc.collect()
+    print(f'{end:8d} allocations: {rss() / 2**20:8.1f} MB')
+
+  growth = (rss() - baseline) / 2**20
+  print(f'Growth after the warm-up: {growth:.1f} MB')
+  if growth > args.max_growth_mb:
+    print(f'RSS grew more than {args.max_growth_mb:.1f} MB', file=sys.stderr)
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
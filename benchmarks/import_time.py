@@ -0,0 +1,78 @@
+"""
+Startup time of `import quoll.activate`, measured with `python -X importtime`
+in fresh interpreters. Reports the cumulative import time of the slowest
+modules and fails if importing it initialised any backend provider:
+
+  python benchmarks/import_time.py -n 10 --max-ms 2000
+
+"""
+import os
+import sys
+import statistics
+import subprocess
+from argparse import ArgumentParser
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENT = 'import quoll.activate'
+
+# Run after the import. Providers are created on first use only, so loading
+# the IBMQ account never happens at import time.
+CHECK = 'import quoll.config; print(*quoll.config._PROVIDER_INSTANCES)'
+
+
+def import_times(statement: str):
+  """Cumulative import time, in microseconds, of each imported module, and
+  the output of the check run after the import."""
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+    filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+  process = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'{statement}; {CHECK}'],
+    env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    universal_newlines=True, check=True)
+
+  times = {}
+  for line in process.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, module = line[len('import time:'):].split('|')
+    times[module.strip()] = int(cumulative)
+  return times, process.stdout.split()
+
+def main(argv=None):
+  parser = ArgumentParser()
+  parser.add_argument('-n', '--runs', type=int, default=5, help='number of fresh interpreters to measure.')
+  parser.add_argument('--top', type=int, default=10, help='number of modules to report.')
+  parser.add_argument('--max-ms', type=float, default=None, help='fails if the median import time exceeds it.')
+  args = parser.parse_args(argv)
+
+  samples = defaultdict(list)
+  providers = set()
+  for _ in range(args.runs):
+    times, initialised = import_times(STATEMENT)
+    providers.update(initialised)
+    for module, cumulative in times.items():
+      samples[module].append(cumulative)
+
+  medians = {
+    module: statistics.median(times) for module, times in samples.items()}
+  total = medians['quoll.activate'] / 1000
+  print(f'{STATEMENT}: {total:.1f} ms (median of {args.runs} runs)')
+  for module, median in sorted(medians.items(), key=lambda item: -item[1])[:args.top]:
+    print(f'  {median / 1000:9.1f} ms  {module}')
+
+  failed = False
+  if providers:
+    failed = True
+    print(
+      f'Providers initialised at import time: {", ".join(sorted(providers))}',
+      file=sys.stderr)
+  if args.max_ms is not None and total > args.max_ms:
+    failed = True
+    print(f'Import time exceeds {args.max_ms:.1f} ms', file=sys.stderr)
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
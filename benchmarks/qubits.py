@@ -0,0 +1,50 @@
+"""
+Microbenchmark of `Qubits` views: slicing, indexing and concatenating
+registers, measuring a whole allocation and mapping a gate over a register:
+
+  python benchmarks/qubits.py --size 1000
+
+"""
+import os
+import sys
+import timeit
+import warnings
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quoll.boilerplate as bp
+from quoll.preamble import *
+from quoll.preamble import map as qmap
+
+
+def report(label: str, statement, number: int, unit: str = 'us'):
+  scale = {'us': 1e6, 'ms': 1e3}[unit]
+  elapsed = timeit.timeit(statement, number=number) / number
+  print(f'{label:<20} {elapsed * scale:10.2f} {unit}')
+
+def main(argv=None):
+  parser = ArgumentParser()
+  parser.add_argument('--size', type=int, default=1000, help='qubits of each register.')
+  parser.add_argument('-n', '--number', type=int, default=2000, help='repetitions of the view operations.')
+  args = parser.parse_args(argv)
+
+  warnings.filterwarnings('ignore')
+  with allocation(args.size, args.size) as whole:
+    a, b = whole.qubits
+    report('slice a[1:]', lambda: a[1:], args.number)
+    report(f'index a[{args.size // 2}]', lambda: a[args.size // 2], args.number)
+    report('concat a + b', lambda: a + b, args.number)
+    report('iterate a', lambda: list(a), max(1, args.number // 100))
+
+    def measure_whole():
+      measure(whole)
+      bp.current_allocation().measurement_proxies.clear()
+    report('measure(allocation)', measure_whole, max(1, args.number // 10))
+
+    report('map(H, a)', lambda: qmap(H, a), 5, unit='ms')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
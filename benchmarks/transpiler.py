@@ -0,0 +1,74 @@
+"""
+Translation time of the sample modules and of a synthetic module with
+thousands of qdefs, like generated oracle modules:
+
+  python benchmarks/transpiler.py --qdefs 10000
+
+"""
+import os
+import sys
+import glob
+import time
+import statistics
+import warnings
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from quoll.transpiler import translate
+
+SAMPLES = os.path.join(ROOT, 'quoll_samples')
+
+QDEF_TEMPLATE = '''
+@qdef(adj=True, ctl=True)
+def oracle_{index}(marked, register):
+  for q in register:
+    H(q)
+  R1({angle}, register[0])
+  if superposition(register == {index} % 4):
+    X(marked)
+  Controlled[Z](register[1:], register[0])
+'''
+
+
+def synthetic_module(qdefs: int) -> str:
+  header = 'from quoll.preamble import *\n'
+  return header + ''.join(
+    QDEF_TEMPLATE.format(index=index, angle=index / qdefs)
+    for index in range(qdefs))
+
+def time_translation(source: str, path: str, repeat: int) -> float:
+  """Median wall time, in seconds, of translating `source`."""
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    translate(source, path)
+    times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+def main(argv=None):
+  parser = ArgumentParser()
+  parser.add_argument('--qdefs', type=int, default=10000, help='number of qdefs of the synthetic module.')
+  parser.add_argument('-r', '--repeat', type=int, default=5, help='translations of each module, the median is reported.')
+  args = parser.parse_args(argv)
+
+  warnings.filterwarnings('ignore')
+  total = 0.0
+  paths = sorted(glob.glob(os.path.join(SAMPLES, '**', '*.qll'), recursive=True))
+  for path in paths:
+    with open(path) as source:
+      elapsed = time_translation(source.read(), path, args.repeat)
+    total += elapsed
+    print(f'{elapsed * 1000:9.2f} ms  {os.path.relpath(path, ROOT)}')
+  print(f'{total * 1000:9.2f} ms  all samples')
+
+  source = synthetic_module(args.qdefs)
+  elapsed = time_translation(source, '<synthetic>', max(1, args.repeat // 2))
+  print(f'{elapsed * 1000:9.2f} ms  {args.qdefs} qdefs '
+        f'({elapsed / args.qdefs * 1e6:.1f} us per qdef)')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -1,3 +1,7 @@
+import ast
+import copy
+import hashlib
+from collections import OrderedDict
 from types import ModuleType
 from importlib.machinery import SourceFileLoader
 from contextlib import suppress
@@ -5,20 +9,79 @@ from contextlib import suppress
 from abm.loaders import AbmLoader
 import abm.activate
 
+import quoll.config
 from quoll.transpiler import translate, TranslationContext, BodyTranslator
+from quoll.translation_cache import get_translation_cache
+from quoll.unparser import unparse
 
 class QuollLoader(AbmLoader, SourceFileLoader):
 
   extensions = ('.qll', '.quoll')
 
   def source_to_code(self, data, path, *, _optimize=-1):
-    source = data.decode('utf-8')
-    ast = translate(source, path)
-    return super().source_to_code(ast, path, _optimize=_optimize)
+    cache = get_translation_cache()
+    if cache is None:
+      _, code = self._translate(data, path, _optimize)
+      return code
+
+    show_python = quoll.config.get_show_python()
+    key = cache.key(data, path, self.path_stats(path)['mtime'], _optimize)
+    code = cache.get(key)
+    python_source = cache.get_python(key) if show_python else None
+    if code is not None and (not show_python or python_source is not None):
+      if show_python:
+        quoll.config.write_python(python_source, path)
+      return code
+
+    module, code = self._translate(data, path, _optimize)
+    cache.put(key, code, unparse(module) if show_python else None)
+    return code
+
+  def _translate(self, data, path, _optimize):
+    module = translate(data.decode('utf-8'), path)
+    return module, super().source_to_code(module, path, _optimize=_optimize)
 
 QuollLoader.register()
 
+
+class CellTranslator(ast.NodeTransformer):
+  """Translate IPython cells. Cells without Quoll constructs are left
+  untouched and translations are memoised by the cell contents, locations
+  included, so re-running a cell does not translate it again. Each cell is
+  translated in a fresh context, so generated names do not depend on the
+  cells run before. Each run gets its own copy of the memoised tree.
+  """
+
+  QUOLL_NAMES = frozenset(('allocation', 'qdef', 'superposition', 'measure'))
+
+  def __init__(self, cache_size: int = 256):
+    self._cache_size = cache_size
+    self._translations = OrderedDict()
+
+  def visit(self, node):
+    if not self._uses_quoll(node):
+      return node
+
+    key = hashlib.sha256(
+      ast.dump(node, include_attributes=True).encode('utf-8')).digest()
+    translation = self._translations.get(key)
+    if translation is None:
+      translation = BodyTranslator(TranslationContext()).visit(node)
+      self._translations[key] = translation
+      if len(self._translations) > self._cache_size:
+        self._translations.popitem(last=False)
+    else:
+      self._translations.move_to_end(key)
+
+    # IPython and later transformers may modify the tree they are given.
+    return copy.deepcopy(translation)
+
+  def _uses_quoll(self, node):
+    return any(
+      isinstance(child, ast.Name) and child.id in self.QUOLL_NAMES
+      for child in ast.walk(node))
+
+
 with suppress(NameError):
   ip = get_ipython()
-  context = TranslationContext()
-  ip.ast_transformers.append(BodyTranslator(context))
\ No newline at end of file
+  ip.ast_transformers.append(CellTranslator())
\ No newline at end of file
@@ -1,19 +1,42 @@
+import asyncio
 from functools import partial
-from typing import Type, TypeVar, Any, Tuple, Iterable
+from typing import Type, TypeVar, Any, Callable, Tuple, Iterable, Iterator, List, Optional
 from dataclasses import dataclass
-from collections import deque
+from contextvars import ContextVar
 
 import qiskit
 from qiskit import QuantumRegister, QuantumCircuit, BasicAer, ClassicalRegister
-from qiskit.circuit import Qubit
+from qiskit.circuit import Gate, Qubit
+from qiskit.providers.jobstatus import JOB_FINAL_STATES
 
 import quoll
 import quoll.config
-from quoll.measurements import Measurement, MeasurementProxy
+from quoll.measurements import Execution, Measurement, MeasurementProxy
 
 T = TypeVar('T')
 
-__ALLOCATIONS__: deque = deque()
+BASIS_GATES = ['u1', 'u2', 'u3', 'cx', 'id']
+
+# Stacks are immutable tuples held in context variables, so each thread and
+# asyncio task builds its own allocations without interfering with others.
+__ALLOCATIONS__: ContextVar = ContextVar('__ALLOCATIONS__', default=())
+
+__BATCHES__: ContextVar = ContextVar('__BATCHES__', default=())
+
+def current_allocation() -> Any:
+  allocations = __ALLOCATIONS__.get()
+  assert len(allocations) > 0, 'There is no allocation in the current context.'
+  return allocations[-1]
+
+def push_allocation(allocation):
+  __ALLOCATIONS__.set((*__ALLOCATIONS__.get(), allocation))
+
+def pop_allocation():
+  __ALLOCATIONS__.set(__ALLOCATIONS__.get()[:-1])
+
+def current_batch() -> Optional['Batch']:
+  batches = __BATCHES__.get()
+  return batches[-1] if len(batches) else None
 
 def singleton(cls: Type[T]) -> T:
   return cls()
@@ -21,14 +44,203 @@ def singleton(cls: Type[T]) -> T:
 
 def execute(*proxies: MeasurementProxy):
   assert len(proxies) > 0, 'No measurement proxies were provided.'
-  circuit = __ALLOCATIONS__[-1].circuit
+  circuit = current_allocation().circuit
+  batch = current_batch()
+  if batch is not None:
+    execution = batch.defer(circuit)
+  else:
+    circuit = _prepare(circuit)
+    execution = Execution(circuit, _run([circuit]))
+  return tuple(map(partial(Measurement, execution=execution), proxies))
+
+async def execute_async(*proxies: MeasurementProxy, poll_interval: float = 0.1):
+  """Like `execute` but waits for the backend without blocking the event
+  loop, so several allocations can be in flight at the same time."""
+  assert len(proxies) > 0, 'No measurement proxies were provided.'
+  circuit = current_allocation().circuit
+  batch = current_batch()
+  if batch is not None:
+    execution = batch.defer(circuit)
+  else:
+    circuit = _prepare(circuit)
+    loop = asyncio.get_running_loop()
+    job = await loop.run_in_executor(None, _submit, [circuit])
+    while not await loop.run_in_executor(None, _is_finished, job):
+      await asyncio.sleep(poll_interval)
+    execution = Execution(circuit, job.result())
+  return tuple(map(partial(Measurement, execution=execution), proxies))
+
+def _prepare(circuit: QuantumCircuit) -> QuantumCircuit:
+  if quoll.config.get_backend_options().optimize:
+    from quoll.optimization import optimize
+    circuit, _ = optimize(circuit)
+  return circuit
+
+def _run(circuits: List[QuantumCircuit]):
+  return _submit(circuits).result()
+
+def _submit(circuits: List[QuantumCircuit]):
+  from quoll.result_cache import get_result_cache
+  cache = get_result_cache()
+  if cache is not None:
+    return cache.submit(circuits, _submit_to_backend)
+  return _submit_to_backend(circuits)
+
+def _submit_to_backend(circuits: List[QuantumCircuit]):
   backend = quoll.config.get_backend()
-  basis_gates = ['u1', 'u2', 'u3', 'cx', 'id']
-  result = qiskit.execute(
-    [circuit], backend=backend,
-    shots=quoll.config.get_shots(),
-    basis_gates=basis_gates).result()
-  return tuple(map(partial(Measurement, result=result), proxies))
+  options = quoll.config.get_backend_options()
+  # Backends running Quoll circuits directly skip transpilation and assembly.
+  run_circuits = getattr(backend, 'run_circuits', None)
+  if run_circuits is not None:
+    return run_circuits(circuits, options)
+
+  if options.exact and _is_statevector_backend(backend):
+    from quoll.simulator import run_exactly
+    job = run_exactly(backend, circuits, options)
+    if job is not None:
+      return job
+
+  return qiskit.execute(
+    circuits, backend=backend,
+    basis_gates=BASIS_GATES,
+    **options.execute_kwargs())
+
+def _is_statevector_backend(backend) -> bool:
+  return backend.name().startswith('statevector')
+
+def _is_finished(job) -> bool:
+  return job.status() in JOB_FINAL_STATES
+
+
+class _PendingJob:
+
+  circuits: List[QuantumCircuit]
+
+  def __init__(self):
+    self.circuits = []
+    self._result = None
+
+  @property
+  def done(self) -> bool:
+    return self._result is not None
+
+  def result(self):
+    if self._result is None:
+      self._result = _run(self.circuits)
+    return self._result
+
+
+class Batch:
+  """Defer the execution of allocations and submit their circuits to the
+  backend as a single job. The job runs when the first measurement obtained
+  inside the batch is used, or when leaving the batch."""
+
+  runs_circuits = True
+
+  def __init__(self):
+    self._job = _PendingJob()
+
+  def defer(self, circuit: QuantumCircuit) -> Execution:
+    """Queue the allocation `circuit`, as built by Quoll, for execution."""
+    if self._job.done:
+      self._job = _PendingJob()
+
+    job = self._job
+    circuit = _prepare(circuit.copy())
+    job.circuits.append(circuit)
+    return Execution(
+      circuit, experiment=len(job.circuits) - 1, resolve=job.result)
+
+  def flush(self):
+    if len(self._job.circuits):
+      self._job.result()
+
+  def __enter__(self):
+    __BATCHES__.set((*__BATCHES__.get(), self))
+    return self
+
+  def __exit__(self, *_):
+    __BATCHES__.set(__BATCHES__.get()[:-1])
+    self.flush()
+
+def repeat(iterations: Iterable[int], operations: Callable[[], Tuple[Callable, ...]]) -> Iterator[int]:
+  """Iterate a loop whose body only applies the gates returned by
+  `operations` with loop-invariant arguments. The body runs once and, if it
+  only appended unitary gates to the current allocation, it is appended as a
+  single gate repeated for the rest of the iterations. Otherwise, the loop
+  runs as usual. `operations` is only called for loops of two iterations or
+  more, and they are all expected to be marked as `__ispure__`.
+
+  The loop variable is bound to the last value of `iterations` first, since
+  the body does not use it but the code after the loop may.
+  """
+  allocations = __ALLOCATIONS__.get()
+  if not isinstance(iterations, range) or len(iterations) < 2\
+    or not len(allocations)\
+    or not all(getattr(operation, '__ispure__', False) for operation in operations()):
+    yield from iterations
+    return
+
+  allocation = allocations[-1]
+  circuit = allocation.circuit
+  start = len(circuit.data)
+  register_count = len(circuit.qregs) + len(circuit.cregs)
+  yield iterations[-1]
+
+  body = None
+  if current_allocation() is allocation\
+    and len(circuit.qregs) + len(circuit.cregs) == register_count:
+    body = gate_from_instructions(circuit.data[start:], 'loop')
+  if body is None:
+    yield from iterations[1:]
+    return
+
+  gate, qubits = body
+  append(circuit, gate.repeat(len(iterations) - 1), qubits)
+
+def compare(left, right):
+  """Comparison in the test of a quantum if: the translation replaces
+  `superposition(a == b)` with `superposition(bp.compare(a, b))`. Registers
+  are compared by value through `Qubits.equals`, since `==` compares them as
+  views. Integers are compared through `==`, as in `q == 1`."""
+  if isinstance(left, int):
+    left, right = right, left
+  if isinstance(right, int):
+    return left == right
+  return left.equals(right)
+
+def gate_from_instructions(instructions, name: str) -> Optional[Tuple[Gate, List[Qubit]]]:
+  """Gate applying `instructions`, and the qubits to apply it to, or None if
+  some instruction is not a unitary gate or they act on no qubits."""
+  positions = {}
+  for instruction, qargs, cargs in instructions:
+    if not isinstance(instruction, Gate) or cargs\
+      or instruction.condition is not None:
+      return None
+    for qubit in qargs:
+      positions.setdefault(qubit, len(positions))
+
+  if not positions:
+    return None
+
+  body = QuantumCircuit(len(positions), name=name)
+  for instruction, qargs, _ in instructions:
+    body.append(instruction, [positions[qubit] for qubit in qargs])
+  return body.to_gate(), list(positions)
+
+def append(circuit: QuantumCircuit, instruction, qubits: Iterable[Qubit]):
+  """Append `instruction` on `qubits`. `QuantumCircuit.append` flattens
+  every register of the circuit to resolve its arguments, which makes
+  emitting a gate O(width) and building wide circuits quadratic."""
+  qubits = list(qubits)
+  assert instruction.num_qubits == len(qubits),\
+    f'{instruction.name} acts on {instruction.num_qubits} qubits, not {len(qubits)}'
+  circuit._append(instruction, qubits, [])
+
+def broadcast(circuit: QuantumCircuit, gate: Gate, qubits: Iterable[Qubit]):
+  """Append the one-qubit `gate` on each of `qubits`."""
+  for qubit in qubits:
+    append(circuit, gate, [qubit])
 
 def new_circuit_with_registers(registers: Iterable[QuantumRegister]) -> QuantumCircuit:
   return QuantumCircuit(*registers)
@@ -3,8 +3,17 @@ Provide command line interface. Basic usage, considering a Qiskit account:
 
   quoll -b ibmq:ibmqx4 samples.bell:main
 
+Translate a tree of Quoll sources ahead of time with:
+
+  quoll compile samples
+
+Estimate the resources of a program without running it with:
+
+  quoll estimate samples.bell:main
+
 """
 import os
+import sys
 from argparse import ArgumentParser
 from importlib import import_module
 
@@ -15,15 +24,63 @@ def build_parser():
   parser.add_argument('-b', '--backend', type=str, help='backend name the format \'provider:backend_name\'.')
   parser.add_argument('-c', '--config', type=str, default='quoll.ini', help='Quoll configuration with the execution options among others.')
   parser.add_argument('--show-python', action='store_true', help='generates *.qll.py files with the Python transpiled version of the source.')
+  parser.add_argument('--batch', action='store_true', help='defers the execution of allocations and submits their circuits together.')
   return parser
 
-def main():
-  parser = build_parser()
-  args = parser.parse_args()
+def build_compile_parser():
+  parser = ArgumentParser(prog='quoll compile')
+  parser.add_argument('paths', type=str, nargs='+', help='Quoll files or directories to compile recursively.')
+  parser.add_argument('-c', '--config', type=str, default='quoll.ini', help='Quoll configuration with the translation options among others.')
+  parser.add_argument('-f', '--force', action='store_true', help='compiles the files even if their bytecode is up to date.')
+  parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes, all the cores by default.')
+  parser.add_argument('-q', '--quiet', action='store_true', help='only reports errors.')
+  parser.add_argument('--show-python', action='store_true', help='generates *.qll.py files with the Python transpiled version of the source.')
+  return parser
+
+def compile_main(argv):
+  parser = build_compile_parser()
+  args = parser.parse_args(argv)
 
   import quoll.config
   quoll.config.set_show_python(args.show_python)
 
+  if args.config:
+    filepath = os.path.join(os.getcwd(), args.config)
+    quoll.config.set_config_file(filepath)
+
+  from quoll.compiler import compile_paths
+  failures = compiled = skipped = 0
+  for result in compile_paths(args.paths, force=args.force, workers=args.workers):
+    if result.error:
+      failures += 1
+      print(f'Error compiling {result.path}: {result.error}', file=sys.stderr)
+    elif result.compiled:
+      compiled += 1
+      if not args.quiet:
+        print(f'Compiled {result.path} in {result.elapsed:.3f}s')
+    else:
+      skipped += 1
+      if not args.quiet:
+        print(f'Skipped {result.path} (up to date)')
+
+  if not args.quiet:
+    print(f'{compiled} compiled, {skipped} skipped, {failures} failed')
+
+  return 1 if failures else 0
+
+def build_estimate_parser():
+  parser = ArgumentParser(prog='quoll estimate')
+  parser.add_argument('modulefunc', type=str, help='function path in the format \'package.module:function_name\'.')
+  parser.add_argument('-b', '--backend', type=str, help='backend name the format \'provider:backend_name\', whose options are used for transpiling.')
+  parser.add_argument('-c', '--config', type=str, default='quoll.ini', help='Quoll configuration with the execution options among others.')
+  parser.add_argument('--no-transpile', action='store_true', help='only reports the resources of the circuits as emitted by Quoll.')
+  return parser
+
+def estimate_main(argv):
+  parser = build_estimate_parser()
+  args = parser.parse_args(argv)
+
+  import quoll.config
   if args.config:
     filepath = os.path.join(os.getcwd(), args.config)
     quoll.config.set_config_file(filepath)
@@ -31,7 +88,37 @@ def main():
   if args.backend:
     quoll.config.set_backend(args.backend)
 
-  module_and_function = args.modulefunc.split(':')
+  from quoll.estimation import estimate
+  function = _load_function(args.modulefunc)
+  if function is None:
+    parser.error('a function is needed for estimating its resources.')
+
+  estimates = estimate(function, transpile=not args.no_transpile)
+  for index, circuit_estimate in enumerate(estimates):
+    print(f'Circuit {index} ({circuit_estimate.circuit.name})')
+    _print_resources('emitted', circuit_estimate.emitted)
+    if circuit_estimate.optimized is not None:
+      _print_resources('optimized', circuit_estimate.optimized)
+    if circuit_estimate.transpiled is not None:
+      _print_resources('transpiled', circuit_estimate.transpiled)
+
+  if not estimates:
+    print('No allocation was executed.')
+
+  return 0
+
+def _print_resources(label, resources):
+  from quoll.estimation import format_memory
+  print(
+    f'  {label}: width={resources.width} clbits={resources.clbits}'
+    f' depth={resources.depth} size={resources.size}'
+    f' statevector={format_memory(resources.statevector_memory)}')
+  gate_counts = ', '.join(
+    f'{name}={count}' for name, count in sorted(resources.gate_counts.items()))
+  print(f'    gates: {gate_counts}')
+
+def _load_function(modulefunc):
+  module_and_function = modulefunc.split(':')
   if len(module_and_function) == 2:
     module_name, function_name = module_and_function
   else:
@@ -39,9 +126,36 @@ def main():
 
   import quoll.activate
   module = import_module(module_name)
-  if function_name:
-    function = getattr(module, function_name)
-    function()
+  return getattr(module, function_name) if function_name else None
+
+def main():
+  if sys.argv[1:2] == ['compile']:
+    sys.exit(compile_main(sys.argv[2:]))
+
+  if sys.argv[1:2] == ['estimate']:
+    sys.exit(estimate_main(sys.argv[2:]))
+
+  parser = build_parser()
+  args = parser.parse_args()
+
+  import quoll.config
+  quoll.config.set_show_python(args.show_python)
+
+  if args.config:
+    filepath = os.path.join(os.getcwd(), args.config)
+    quoll.config.set_config_file(filepath)
+
+  if args.backend:
+    quoll.config.set_backend(args.backend)
+
+  function = _load_function(args.modulefunc)
+  if function:
+    if args.batch:
+      import quoll.boilerplate as bp
+      with bp.Batch():
+        function()
+    else:
+      function()
 
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Ahead-of-time compilation of Quoll sources. Translates whole trees of
+`*.qll` files into regular `__pycache__` bytecode, in parallel, so importing
+them later does not pay the translation cost.
+"""
+import os
+import time
+import marshal
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from importlib.util import cache_from_source, MAGIC_NUMBER
+from typing import Iterable, Iterator, List, Optional
+
+import quoll.config
+
+_SKIPPED_DIRECTORIES = ('__pycache__',)
+
+
+@dataclass
+class CompilationResult:
+
+  path: str
+
+  compiled: bool = False
+
+  elapsed: float = 0.0
+
+  error: Optional[str] = None
+
+
+def find_sources(paths: Iterable[str]) -> List[str]:
+  """Quoll sources of `paths`. Paths that do not exist are kept, so compiling
+  them reports the error."""
+  from quoll.activate import QuollLoader
+  sources = []
+  for path in paths:
+    if not os.path.isdir(path):
+      sources.append(path)
+      continue
+
+    for directory, subdirectories, files in os.walk(path):
+      subdirectories[:] = sorted(
+        name for name in subdirectories if name not in _SKIPPED_DIRECTORIES)
+      sources.extend(
+        os.path.join(directory, name) for name in sorted(files)
+        if name.endswith(QuollLoader.extensions))
+
+  return sources
+
+def compile_file(path: str, force: bool = False) -> CompilationResult:
+  from quoll.activate import QuollLoader
+  bytecode_path = cache_from_source(path)
+  try:
+    source_stat = os.stat(path)
+    if not force and _is_up_to_date(bytecode_path, source_stat):
+      return CompilationResult(path)
+
+    start = time.perf_counter()
+    with open(path, 'rb') as file_:
+      data = file_.read()
+
+    loader = QuollLoader(_module_name(path), path)
+    code = loader.source_to_code(data, path)
+    bytecode = _timestamp_pyc(code, source_stat)
+    _write_bytecode(bytecode_path, bytecode)
+    return CompilationResult(
+      path, compiled=True, elapsed=time.perf_counter() - start)
+
+  except Exception as error:
+    # Exceptions are reported as text since not all of them can be pickled
+    # back from the worker processes.
+    return CompilationResult(path, error=f'{type(error).__name__}: {error}')
+
+def compile_paths(
+  paths: Iterable[str],
+  force: bool = False,
+  workers: Optional[int] = None) -> Iterator[CompilationResult]:
+  sources = find_sources(paths)
+  if workers == 1 or len(sources) < 2:
+    for path in sources:
+      yield compile_file(path, force)
+    return
+
+  with ProcessPoolExecutor(
+    max_workers=workers,
+    initializer=_initialize_worker,
+    initargs=(quoll.config.get_config_file(), quoll.config.get_show_python())
+  ) as executor:
+    yield from executor.map(
+      compile_file, sources, [force] * len(sources), chunksize=1)
+
+
+def _initialize_worker(config_file: str, show_python: bool):
+  quoll.config.set_config_file(config_file)
+  quoll.config.set_show_python(show_python)
+
+# `*.pyc` files validated by the source timestamp, as laid out in PEP 552: the
+# magic number, zero flags, and the source mtime and size as 32-bit integers,
+# followed by the marshalled code.
+
+def _timestamp_pyc(code, source_stat: os.stat_result) -> bytes:
+  return b''.join((
+    MAGIC_NUMBER,
+    (0).to_bytes(4, 'little'),
+    (int(source_stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little'),
+    (source_stat.st_size & 0xFFFFFFFF).to_bytes(4, 'little'),
+    marshal.dumps(code)))
+
+def _is_up_to_date(bytecode_path: str, source_stat: os.stat_result) -> bool:
+  try:
+    with open(bytecode_path, 'rb') as file_:
+      header = file_.read(16)
+  except OSError:
+    return False
+
+  if len(header) < 16 or header[:4] != MAGIC_NUMBER:
+    return False
+
+  flags = int.from_bytes(header[4:8], 'little')
+  mtime = int.from_bytes(header[8:12], 'little')
+  size = int.from_bytes(header[12:16], 'little')
+  return flags == 0\
+    and mtime == int(source_stat.st_mtime) & 0xFFFFFFFF\
+    and size == source_stat.st_size & 0xFFFFFFFF
+
+def _write_bytecode(path: str, bytecode: bytes):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  temporary_path = f'{path}.{os.getpid()}.tmp'
+  with open(temporary_path, 'wb') as file_:
+    file_.write(bytecode)
+  os.replace(temporary_path, path)
+
+def _module_name(path: str) -> str:
+  return os.path.splitext(os.path.basename(path))[0]
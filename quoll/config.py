@@ -1,63 +1,282 @@
 import os
 from configparser import ConfigParser
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
 
-import qiskit
 import quoll.boilerplate as bp
 from quoll.unparser import unparse
 
-_PROVIDERS = { 'basicaer': qiskit.BasicAer }
-if hasattr(qiskit, 'IBMQ'):
-  qiskit.IBMQ.load_account()
-  _PROVIDERS['ibmq'] = qiskit.IBMQ.get_provider()
+def _basicaer_provider():
+  from qiskit import BasicAer
+  return BasicAer
 
-if hasattr(qiskit, 'Aer'):
-  _PROVIDERS['aer'] = qiskit.Aer
+def _aer_provider():
+  from qiskit import Aer
+  return Aer
 
-_CONFIG_FILE = 'quoll.ini'
+def _ibmq_provider():
+  from qiskit import IBMQ
+  IBMQ.load_account()
+  return IBMQ.get_provider()
 
-_BACKEND = 'basicaer:qasm_simulator'
+def _quoll_provider():
+  from quoll.simulator import QuollProvider
+  return QuollProvider()
+
+# Providers are created the first time one of their backends is resolved.
+# Third-party providers can be plugged with a `quoll.providers` entry point
+# pointing to a factory with no parameters.
+_PROVIDERS: Dict[str, Callable[[], Any]] = {
+  'basicaer': _basicaer_provider,
+  'aer': _aer_provider,
+  'ibmq': _ibmq_provider,
+  'quoll': _quoll_provider
+}
+
+_PROVIDER_INSTANCES: Dict[str, Any] = {}
+
+_PROVIDERS_ENTRY_POINT = 'quoll.providers'
+
+_DEFAULT_BACKEND = 'basicaer:qasm_simulator'
+
+_BACKEND: Optional[str] = None
 
 _SHOW_PYTHON = False
 
+@dataclass
+class BackendOptions:
+  """Execution options for one backend, as read from its `[backend:...]`
+  section (falling back to `[backend:*]`)."""
+
+  shots: int = 1024
+
+  optimization_level: Optional[int] = None
+
+  seed_simulator: Optional[int] = None
+
+  max_parallel_threads: Optional[int] = None
+
+  optimize: bool = False
+
+  exact: bool = False
+
+  def execute_kwargs(self) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {'shots': self.shots}
+    if self.optimization_level is not None:
+      kwargs['optimization_level'] = self.optimization_level
+    if self.seed_simulator is not None:
+      kwargs['seed_simulator'] = self.seed_simulator
+    if self.max_parallel_threads is not None:
+      kwargs['backend_options'] = {
+        'max_parallel_threads': self.max_parallel_threads}
+    return kwargs
+
+
+def _default_cache_directory() -> str:
+  cache_home = os.environ.get(
+    'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+  return os.environ.get('QUOLL_CACHE_DIR', os.path.join(cache_home, 'quoll'))
+
+@dataclass
+class TranslationCacheOptions:
+  """Options of the persistent cache of translated modules, as read from the
+  `[translation_cache]` section."""
+
+  enabled: bool = False
+
+  directory: str = field(default_factory=_default_cache_directory)
+
+  max_size: int = 64 * 1024 * 1024
+
+
+def _default_result_cache_directory() -> str:
+  return os.path.join(_default_cache_directory(), 'results')
+
+@dataclass
+class ResultCacheOptions:
+  """Options of the cache of execution results, as read from the
+  `[result_cache]` section."""
+
+  enabled: bool = False
+
+  memory_size: int = 256
+
+  directory: str = field(default_factory=_default_result_cache_directory)
+
+  max_size: int = 64 * 1024 * 1024
+
+
+class Configuration:
+  """Quoll configuration file, parsed once and re-read only if it changes on
+  disk (or after an explicit `reload()`). Backends and backend options are
+  resolved once per `provider:name` id."""
+
+  def __init__(self, path: str):
+    self._path = path
+    self._mtime: Optional[int] = None
+    self._parser = ConfigParser()
+    self._options: Dict[str, BackendOptions] = {}
+    self._backends: Dict[str, Any] = {}
+    self.reload()
+
+  @property
+  def path(self) -> str:
+    return self._path
+
+  @path.setter
+  def path(self, path: str):
+    self._path = path
+    self.reload()
+
+  def reload(self):
+    parser = ConfigParser()
+    parser.read(self._path)
+    self._parser = parser
+    self._mtime = _modification_time(self._path)
+    self._options.clear()
+    self._backends.clear()
+
+  def backend(self, backend_id: str):
+    if backend_id not in self._backends:
+      self._backends[backend_id] = _resolve_backend(*backend_id.split(':'))
+    return self._backends[backend_id]
+
+  def forget_provider(self, provider_name: str):
+    """Drop the backends resolved from `provider_name`."""
+    for backend_id in list(self._backends):
+      if backend_id.split(':')[0] == provider_name:
+        del self._backends[backend_id]
+
+  def backend_options(self, backend_id: str) -> BackendOptions:
+    if self._mtime != _modification_time(self._path):
+      self.reload()
+
+    if backend_id not in self._options:
+      self._options[backend_id] = self._read_backend_options(backend_id)
+    return self._options[backend_id]
+
+  def default_backend(self) -> Optional[str]:
+    if self._mtime != _modification_time(self._path):
+      self.reload()
+
+    return self._parser.get('backend', 'default', fallback=None)
+
+  def translation_cache_options(self) -> TranslationCacheOptions:
+    options = TranslationCacheOptions()
+    if self._parser.has_section('translation_cache'):
+      config = self._parser['translation_cache']
+      options.enabled = config.getboolean('enabled', fallback=options.enabled)
+      options.directory = os.path.expanduser(
+        config.get('directory', fallback=options.directory))
+      options.max_size = config.getint('max_size', fallback=options.max_size)
+    return options
+
+  def result_cache_options(self) -> ResultCacheOptions:
+    if self._mtime != _modification_time(self._path):
+      self.reload()
+
+    options = ResultCacheOptions()
+    if self._parser.has_section('result_cache'):
+      config = self._parser['result_cache']
+      options.enabled = config.getboolean('enabled', fallback=options.enabled)
+      options.memory_size = config.getint(
+        'memory_size', fallback=options.memory_size)
+      options.directory = os.path.expanduser(
+        config.get('directory', fallback=options.directory))
+      options.max_size = config.getint('max_size', fallback=options.max_size)
+    return options
+
+  def _read_backend_options(self, backend_id: str) -> BackendOptions:
+    options = BackendOptions()
+    for section in ('backend:*', f'backend:{backend_id}'):
+      if not self._parser.has_section(section):
+        continue
+
+      config = self._parser[section]
+      options.shots = config.getint('shots', fallback=options.shots)
+      for name in ('optimization_level', 'seed_simulator', 'max_parallel_threads'):
+        setattr(options, name, config.getint(name, fallback=getattr(options, name)))
+      options.optimize = config.getboolean('optimize', fallback=options.optimize)
+      options.exact = config.getboolean('exact', fallback=options.exact)
+
+    return options
+
+
+def _modification_time(path: str) -> Optional[int]:
+  try:
+    return os.stat(path).st_mtime_ns
+  except OSError:
+    return None
+
+_CONFIGURATION = Configuration('quoll.ini')
+
 def get_config_file():
-  return _CONFIG_FILE
+  return _CONFIGURATION.path
 
 def set_config_file(config_file):
-  global _CONFIG_FILE
-  _CONFIG_FILE = config_file
+  _CONFIGURATION.path = config_file
+
+def reload():
+  _CONFIGURATION.reload()
 
 def get_backend():
-  return _resolve_backend(*_BACKEND.split(':'))
+  return _CONFIGURATION.backend(get_backend_id())
+
+def get_backend_id() -> str:
+  return _BACKEND or _CONFIGURATION.default_backend() or _DEFAULT_BACKEND
 
 def set_backend(backend):
   global _BACKEND
   _BACKEND = backend
 
-def _resolve_backend(provider_name, backend_name):
-  if provider_name not in _PROVIDERS:
-    raise ValueError(f'No provider with id {provider_name}')
+def register_provider(provider_name: str, factory: Callable[[], Any]):
+  _PROVIDERS[provider_name] = factory
+  _PROVIDER_INSTANCES.pop(provider_name, None)
+  _CONFIGURATION.forget_provider(provider_name)
+
+def get_provider(provider_name: str):
+  if provider_name not in _PROVIDER_INSTANCES:
+    factory = _PROVIDERS.get(provider_name)
+    if factory is None:
+      factory = _load_provider_entry_point(provider_name)
+    if factory is None:
+      raise ValueError(f'No provider with id {provider_name}')
+
+    _PROVIDER_INSTANCES[provider_name] = factory()
+
+  return _PROVIDER_INSTANCES[provider_name]
 
-  provider = _PROVIDERS[provider_name]
+def _load_provider_entry_point(provider_name: str):
+  from pkg_resources import iter_entry_points
+  for entry_point in iter_entry_points(_PROVIDERS_ENTRY_POINT, provider_name):
+    return entry_point.load()
+
+  return None
+
+def _resolve_backend(provider_name, backend_name):
+  provider = get_provider(provider_name)
   return provider.get_backend(backend_name)
 
 def set_show_python(enabled):
   global _SHOW_PYTHON
   _SHOW_PYTHON = enabled
 
+def get_show_python():
+  return _SHOW_PYTHON
+
 def show_python(translate_fn):
   def _decorated(source, path):
     module = translate_fn(source, path)
     if _SHOW_PYTHON:
-      generated_python_path = f'{path}.py'
-      _print_python(module, generated_python_path)
+      write_python(unparse(module), path)
     return module
 
   return _decorated
 
-def _print_python(module, path):
-  abspath = _resolve_path(os.getcwd(), path)
+def write_python(python_source, path):
+  abspath = _resolve_path(os.getcwd(), f'{path}.py')
   with open(abspath, 'w') as file_:
-    print(unparse(module), file=file_)
+    print(python_source, file=file_)
 
 def _resolve_path(current, relative):
   if os.path.isabs(relative):
@@ -66,17 +285,13 @@ def _resolve_path(current, relative):
   return os.path.normpath(os.path.join(current, relative))
 
 def get_shots():
-  fallback = 1024
-  config = ConfigParser()
-  config.read(get_config_file())
-  section = _get_backend_matching_section(_BACKEND, config)
-  return config[section].getint(
-    'shots', fallback=fallback) if section else fallback
-
-def _get_backend_matching_section(backend_id, config):
-  sections = config.keys()
-  for one_section in sections:
-    if one_section.startswith('backend:'):
-      _, config_backend_id = one_section.split(':', 1)
-      if config_backend_id == '*' or config_backend_id == backend_id:
-        return one_section
\ No newline at end of file
+  return get_backend_options().shots
+
+def get_backend_options() -> BackendOptions:
+  return _CONFIGURATION.backend_options(get_backend_id())
+
+def get_translation_cache_options() -> TranslationCacheOptions:
+  return _CONFIGURATION.translation_cache_options()
+
+def get_result_cache_options() -> ResultCacheOptions:
+  return _CONFIGURATION.result_cache_options()
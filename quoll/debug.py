@@ -12,11 +12,15 @@ class AllocationInspector:
     return _instance
 
   def show(self):
-    print(bp.__ALLOCATIONS__[-1].circuit)
+    print(bp.current_allocation().circuit)
 
   @property
   def circuit(self):
-    return bp.__ALLOCATIONS__[-1].circuit
+    return bp.current_allocation().circuit
+
+  @property
+  def ancilla_pool(self):
+    return bp.current_allocation().ancilla_pool
 
 
 class QDefInspector:
@@ -0,0 +1,74 @@
+"""
+Size-bounded directory of cache entries shared by the persistent caches.
+Entries are files named after their key, and the least recently used ones
+are removed once the directory grows over its maximum size.
+"""
+import os
+from contextlib import suppress
+from threading import get_ident
+from typing import Mapping, Optional, Tuple
+
+
+class DiskCache:
+
+  directory: str
+
+  max_size: int
+
+  suffixes: Tuple[str, ...] = ()
+
+  def __init__(self, directory: str, max_size: int):
+    self.directory = directory
+    self.max_size = max_size
+
+  def _read(self, key: str, suffix: str) -> Optional[bytes]:
+    entry_path = self._entry_path(key, suffix)
+    try:
+      with open(entry_path, 'rb') as file_:
+        data = file_.read()
+    except OSError:
+      return None
+
+    _touch(entry_path)
+    return data
+
+  def _write(self, key: str, entries: Mapping[str, bytes]):
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      for suffix, data in entries.items():
+        _write_atomically(self._entry_path(key, suffix), data)
+      self._evict()
+    except OSError:
+      # A read-only or full cache directory only means no caching.
+      pass
+
+  def _entry_path(self, key: str, suffix: str) -> str:
+    return os.path.join(self.directory, f'{key}{suffix}')
+
+  def _evict(self):
+    entries = []
+    with os.scandir(self.directory) as iterator:
+      for entry in iterator:
+        if entry.name.endswith(self.suffixes):
+          stat = entry.stat()
+          entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total_size <= self.max_size:
+        break
+      with suppress(OSError):
+        os.remove(path)
+      total_size -= size
+
+
+def _touch(path: str):
+  with suppress(OSError):
+    os.utime(path)
+
+def _write_atomically(path: str, data: bytes):
+  # Unique per thread, since several threads may write the same entry.
+  temporary_path = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+  with open(temporary_path, 'wb') as file_:
+    file_.write(data)
+  os.replace(temporary_path, path)
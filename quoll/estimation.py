@@ -0,0 +1,126 @@
+"""
+Estimate the resources a Quoll program needs without running it. Inside an
+`Estimator`, executing an allocation collects its circuit and returns
+placeholder measurements reading 0, so the program runs up to the end while
+nothing is sent to the backend.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import qiskit
+from qiskit import QuantumCircuit
+
+import quoll.config
+import quoll.boilerplate as bp
+from quoll.measurements import Execution, PlaceholderExecution
+
+# Bytes per amplitude of a double precision statevector.
+_AMPLITUDE_SIZE = 16
+
+
+@dataclass
+class CircuitResources:
+
+  width: int
+
+  clbits: int
+
+  depth: int
+
+  size: int
+
+  gate_counts: Dict[str, int] = field(default_factory=dict)
+
+  @property
+  def statevector_memory(self) -> int:
+    """Bytes needed for simulating the circuit with a statevector."""
+    return _AMPLITUDE_SIZE * 2**self.width
+
+  @classmethod
+  def of(cls, circuit: QuantumCircuit) -> 'CircuitResources':
+    return cls(
+      width=circuit.num_qubits,
+      clbits=circuit.num_clbits,
+      depth=circuit.depth(),
+      size=circuit.size(),
+      gate_counts=dict(circuit.count_ops()))
+
+
+@dataclass
+class ResourceEstimate:
+  """Resources of one allocation circuit, as emitted by Quoll, after the
+  peephole pass if the backend enables it, and, if requested, after
+  transpiling the circuit that would run to the basis gates used for
+  execution."""
+
+  circuit: QuantumCircuit
+
+  emitted: CircuitResources
+
+  optimized: Optional[CircuitResources] = None
+
+  transpiled: Optional[CircuitResources] = None
+
+
+class Estimator(bp.Batch):
+
+  runs_circuits = False
+
+  circuits: List[QuantumCircuit]
+
+  def __init__(self):
+    super().__init__()
+    self.circuits = []
+
+  def defer(self, circuit: QuantumCircuit) -> Execution:
+    circuit = circuit.copy()
+    self.circuits.append(circuit)
+    return PlaceholderExecution(circuit)
+
+  def flush(self):
+    pass
+
+  def estimates(self, transpile: bool = True) -> List[ResourceEstimate]:
+    return [_estimate_circuit(circuit, transpile) for circuit in self.circuits]
+
+
+def estimate(
+  function: Callable, *args: Any, transpile: bool = True,
+  **kwargs: Any) -> List[ResourceEstimate]:
+  """Run `function` collecting the circuits of its allocations instead of
+  executing them, and return their resources."""
+  with Estimator() as estimator:
+    function(*args, **kwargs)
+
+  return estimator.estimates(transpile)
+
+
+def _estimate_circuit(circuit: QuantumCircuit, transpile: bool) -> ResourceEstimate:
+  estimate = ResourceEstimate(circuit, CircuitResources.of(circuit))
+  options = quoll.config.get_backend_options()
+  if options.optimize:
+    from quoll.optimization import optimize
+    circuit, _ = optimize(circuit)
+    estimate.optimized = CircuitResources.of(circuit)
+  if transpile:
+    transpiled = qiskit.transpile(
+      circuit, basis_gates=bp.BASIS_GATES,
+      optimization_level=options.optimization_level)
+    estimate.transpiled = CircuitResources.of(transpiled)
+  return estimate
+
+_MEMORY_UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB', 'EiB')
+
+def format_memory(size: int) -> str:
+  """Format a number of bytes. Sizes beyond the largest unit, as those of
+  wide statevectors, are written as powers of two, since they do not fit in
+  a float."""
+  exponent = max(size.bit_length() - 1, 0)
+  scale = min(exponent // 10, len(_MEMORY_UNITS) - 1)
+  if size < 1024**len(_MEMORY_UNITS):
+    return f'{size / 1024**scale:.4g} {_MEMORY_UNITS[scale]}'
+
+  if size == 1 << exponent:
+    return f'2^{exponent} B'
+  mantissa = (size >> (exponent - 52)) / (1 << 52)
+  return f'{mantissa:.4g}*2^{exponent} B'
@@ -1,11 +1,11 @@
 from dataclasses import dataclass, field
-from typing import Tuple, Union
+from itertools import accumulate
+from typing import Callable, Dict, Mapping, Optional, Sequence, Tuple, Union
 
+import numpy as np
 from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
 from qiskit.result import Result
 
-import quoll.boilerplate as bp
-
 @dataclass
 class MeasurementProxy:
 
@@ -15,26 +15,156 @@ class MeasurementProxy:
 
   classical_register: ClassicalRegister
 
+
+class OutcomeTable:
+  """Histogram of one execution. Each distinct outcome is the whole classical
+  memory read as an integer, with the first classical register in the least
+  significant bits, next to its weight (counts, or probabilities when the
+  table is `exact`)."""
+
+  outcomes: np.ndarray
+
+  weights: np.ndarray
+
+  offsets: Tuple[int, ...]
+
+  sizes: Tuple[int, ...]
+
+  exact: bool
+
+  def __init__(self, outcomes: np.ndarray, weights: np.ndarray, sizes: Sequence[int], exact: bool = False):
+    self.outcomes = outcomes
+    self.weights = weights
+    self.sizes = tuple(sizes)
+    self.offsets = (0, *accumulate(self.sizes))[:-1]
+    self.exact = exact
+
+  @classmethod
+  def from_counts(cls, counts: Mapping[str, int], sizes: Sequence[int]) -> 'OutcomeTable':
+    # Qiskit separates registers with spaces, the first one on the right, so
+    # removing the spaces gives the whole memory in binary.
+    outcomes = [int(key.replace(' ', ''), 2) for key in counts]
+    dtype = np.int64 if sum(sizes) < 63 else object
+    return cls(
+      np.array(outcomes, dtype=dtype),
+      np.fromiter(counts.values(), dtype=np.float64, count=len(counts)),
+      sizes)
+
+  def values(self, register_index: int) -> np.ndarray:
+    """Value of one register for every outcome."""
+    mask = 2**self.sizes[register_index] - 1
+    return (self.outcomes >> self.offsets[register_index]) & mask
+
+  def most_likely(self, register_index: int) -> int:
+    """Value of one register in the most likely outcome."""
+    outcome = self.outcomes[int(np.argmax(self.weights))]
+    return int(outcome >> self.offsets[register_index]) & (2**self.sizes[register_index] - 1)
+
+  def marginal(self, register_index: int) -> Dict[int, float]:
+    values, inverse = np.unique(self.values(register_index), return_inverse=True)
+    weights = np.bincount(inverse, weights=self.weights) / self.weights.sum()
+    return dict(zip(map(int, values), weights))
+
+  def samples(self, register_index: int) -> np.ndarray:
+    """Value of one register for every shot."""
+    if self.exact:
+      raise ValueError('Exact outcome tables come from probabilities, not shots.')
+    return np.repeat(self.values(register_index), self.weights.astype(np.int64))
+
+  def probability(self, expected: Mapping[int, int]) -> float:
+    """Probability of the registers taking the expected values, regardless
+    of the values of the rest of registers."""
+    mask, value = 0, 0
+    for register_index, register_value in expected.items():
+      offset = self.offsets[register_index]
+      mask |= (2**self.sizes[register_index] - 1) << offset
+      value |= register_value << offset
+
+    favorable = self.weights[(self.outcomes & mask) == value].sum()
+    return float(favorable / self.weights.sum())
+
+
+class Execution:
+  """Execution of one circuit. When the circuit was deferred by a batch, the
+  result is resolved the first time it is needed."""
+
+  circuit: QuantumCircuit
+
+  def __init__(
+      self, circuit: QuantumCircuit, result: Optional[Result] = None, *,
+      experiment: Union[int, QuantumCircuit, None] = None,
+      resolve: Optional[Callable[[], Result]] = None):
+    assert result is not None or resolve is not None,\
+      'An execution needs either a result or a way of resolving it.'
+    self.circuit = circuit
+    self.experiment = circuit if experiment is None else experiment
+    self._result = result
+    self._resolve = resolve
+    self._outcomes: Optional[OutcomeTable] = None
+
+  @property
+  def result(self) -> Result:
+    if self._result is None:
+      self._result = self._resolve()
+      self._resolve = None
+    return self._result
+
+  @property
+  def outcomes(self) -> OutcomeTable:
+    if self._outcomes is None:
+      # Results able to compute the outcome probabilities expose them, and
+      # then there are no counts to parse.
+      get_outcome_table = getattr(self.result, 'get_outcome_table', None)
+      if get_outcome_table is not None:
+        self._outcomes = get_outcome_table(self.experiment)
+      if self._outcomes is None:
+        self._outcomes = OutcomeTable.from_counts(
+          self.get_counts(), [register.size for register in self.circuit.cregs])
+    return self._outcomes
+
+  def get_counts(self):
+    return self.result.get_counts(self.experiment)
+
+  def register_index(self, register: ClassicalRegister) -> int:
+    return self.circuit.cregs.index(register)
+
+
+class PlaceholderExecution(Execution):
+  """Execution of a circuit that is never run, where every classical
+  register reads 0. Used when estimating resources."""
+
+  def __init__(self, circuit: QuantumCircuit):
+    super().__init__(circuit, resolve=self._no_result)
+    sizes = [register.size for register in circuit.cregs]
+    self._outcomes = OutcomeTable(
+      np.zeros(1, dtype=np.int64), np.ones(1), sizes)
+
+  def get_counts(self):
+    return {' '.join('0' * register.size for register in reversed(self.circuit.cregs)): 1}
+
+  def _no_result(self) -> Result:
+    raise RuntimeError('Placeholder executions have no result.')
+
+
 @dataclass
 class Measurement:
 
   proxy: MeasurementProxy
 
-  result: Result
+  execution: Execution
 
-  measurement_bitstring: int = field(init=False)
+  @property
+  def register_index(self) -> int:
+    return self.execution.register_index(self.proxy.classical_register)
 
-  def __post_init__(self):
-    whole_memory_bitstring, _ = max(
-      self.result.get_counts().items(), key=lambda item: item[1])
+  def marginal(self) -> Dict[int, float]:
+    return self.execution.outcomes.marginal(self.register_index)
 
-    # TODO: Endian mess. Should clarify this is this way and add some tests.
-    registers_bitstrings = list(reversed(whole_memory_bitstring.split(' ')))
-    self.measurement_bitstring = registers_bitstrings[
-      bp.__ALLOCATIONS__[-1].circuit.cregs.index(self.proxy.classical_register)]
+  def samples(self) -> np.ndarray:
+    return self.execution.outcomes.samples(self.register_index)
 
   def __int__(self):
-    return int(self.measurement_bitstring, 2)
+    return self.execution.outcomes.most_likely(self.register_index)
 
   def __bool__(self):
     return bool(int(self))
@@ -0,0 +1,158 @@
+"""
+Peephole optimisation of allocation circuits before they are sent to the
+backend. It cancels adjacent self-inverse gates, merges consecutive rotations
+around the same axis and turns X conjugations of control qubits into open
+controls.
+"""
+import logging
+from math import pi, isclose
+from typing import List, Optional, Tuple
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate, Gate
+
+_logger = logging.getLogger(__name__)
+
+_SELF_INVERSE = frozenset(('x', 'y', 'z', 'h', 'cx', 'cy', 'cz', 'swap'))
+
+_ROTATIONS = frozenset(('u1', 'rx', 'ry', 'rz'))
+
+_Entry = Tuple[Gate, list, list]
+
+
+def optimize(circuit: QuantumCircuit) -> Tuple[QuantumCircuit, int]:
+  """Return an optimised copy of `circuit` and the number of gates removed."""
+  entries = PeepholeOptimizer().run(circuit.data)
+  removed = len(circuit.data) - len(entries)
+  if not removed:
+    return circuit, 0
+
+  optimized = circuit.copy()
+  optimized.data = entries
+  _logger.info(
+    'Peephole optimisation removed %d of %d gates in %s',
+    removed, len(circuit.data), circuit.name)
+  return optimized, removed
+
+
+class PeepholeOptimizer:
+  """Single pass over the circuit keeping, per qubit, the stack of the
+  surviving instructions acting on it. A new gate is only combined with the
+  instructions on top of the stacks of its qubits, which are the ones
+  immediately before it on those wires."""
+
+  def run(self, data: List[_Entry]) -> List[_Entry]:
+    self._entries: List[Optional[_Entry]] = []
+    self._wires = {}
+    for entry in data:
+      if not self._combine(entry):
+        self._push(entry)
+
+    return [entry for entry in self._entries if entry is not None]
+
+  def _combine(self, entry: _Entry) -> bool:
+    instruction, qargs, cargs = entry
+    if cargs or not isinstance(instruction, Gate)\
+      or instruction.condition is not None:
+      return False
+
+    previous_index = self._common_top(qargs)
+    if previous_index is not None:
+      previous, previous_qargs, _ = self._entries[previous_index]
+      if _are_inverses(previous, previous_qargs, instruction, qargs):
+        self._remove(previous_index, qargs)
+        return True
+
+      if _are_mergeable_rotations(previous, previous_qargs, instruction, qargs):
+        self._merge_rotations(previous_index, instruction)
+        return True
+
+    if instruction.name == 'x' and len(qargs) == 1:
+      return self._open_control(qargs[0])
+
+    return False
+
+  def _merge_rotations(self, index: int, rotation: Gate):
+    previous, qargs, cargs = self._entries[index]
+    angle = float(previous.params[0]) + float(rotation.params[0])
+    if isclose(angle % (2 * pi), 0, abs_tol=1e-12)\
+      or isclose(angle % (2 * pi), 2 * pi, abs_tol=1e-12):
+      # Up to a global phase, a full turn is the identity.
+      self._remove(index, qargs)
+    else:
+      self._entries[index] = (type(previous)(angle), qargs, cargs)
+
+  def _open_control(self, qubit) -> bool:
+    """Collapse X·C(U)·X, with the X gates on a control qubit, into C(U)
+    controlled on that qubit being zero."""
+    stack = self._wires.get(qubit, [])
+    if len(stack) < 2:
+      return False
+
+    controlled_index, flip_index = stack[-1], stack[-2]
+    controlled, controlled_qargs, controlled_cargs = self._entries[controlled_index]
+    flip, flip_qargs, _ = self._entries[flip_index]
+    if not isinstance(controlled, ControlledGate)\
+      or controlled.condition is not None\
+      or not _is_plain_x(flip, flip_qargs):
+      return False
+
+    controls = controlled_qargs[:controlled.num_ctrl_qubits]
+    if qubit not in controls:
+      return False
+
+    open_controlled = controlled.copy()
+    open_controlled.ctrl_state = \
+      controlled.ctrl_state ^ (1 << controls.index(qubit))
+    self._entries[controlled_index] = \
+      (open_controlled, controlled_qargs, controlled_cargs)
+    self._entries[flip_index] = None
+    stack.pop(-2)
+    return True
+
+  def _common_top(self, qargs) -> Optional[int]:
+    tops = set()
+    for qubit in qargs:
+      stack = self._wires.get(qubit)
+      if not stack:
+        return None
+      tops.add(stack[-1])
+
+    return tops.pop() if len(tops) == 1 else None
+
+  def _remove(self, index: int, qargs):
+    self._entries[index] = None
+    for qubit in qargs:
+      self._wires[qubit].pop()
+
+  def _push(self, entry: _Entry):
+    index = len(self._entries)
+    self._entries.append(entry)
+    _, qargs, cargs = entry
+    for wire in (*qargs, *cargs):
+      self._wires.setdefault(wire, []).append(index)
+
+
+def _are_inverses(previous, previous_qargs, gate, qargs) -> bool:
+  return gate.name in _SELF_INVERSE\
+    and previous.name == gate.name\
+    and list(previous_qargs) == list(qargs)\
+    and previous.condition is None\
+    and getattr(previous, 'ctrl_state', None) == getattr(gate, 'ctrl_state', None)
+
+def _are_mergeable_rotations(previous, previous_qargs, gate, qargs) -> bool:
+  return gate.name in _ROTATIONS\
+    and previous.name == gate.name\
+    and list(previous_qargs) == list(qargs)\
+    and previous.condition is None\
+    and _is_number(previous.params[0]) and _is_number(gate.params[0])
+
+def _is_plain_x(gate, qargs) -> bool:
+  return gate.name == 'x' and len(qargs) == 1 and gate.condition is None
+
+def _is_number(value) -> bool:
+  try:
+    float(value)
+  except (TypeError, ValueError):
+    return False
+  return True
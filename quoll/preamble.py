@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod, abstractproperty
 from dataclasses import dataclass
-from typing import overload, Type, TypeVar, Generic, Iterable, List, Callable, Tuple, Sequence, MutableMapping, Union
-from functools import partial, wraps
+from typing import overload, Type, TypeVar, Generic, Iterable, Iterator, List, Callable, Optional, Set, Tuple, Sequence, MutableMapping, Union
+from functools import partial, wraps, update_wrapper
 from itertools import chain, repeat
 from contextlib import contextmanager
+from collections import OrderedDict
+from types import MethodType
+from threading import Lock
 
 from quoll.measurements import Measurement, MeasurementProxy
 import quoll.boilerplate as bp
@@ -16,7 +19,12 @@ def qdef(*args, **kwargs):
     return qdef()(args[0])
 
   def _decorator(item):
+    if kwargs.get('cache', False):
+      item = CachedOperation(item, maxsize=kwargs.get('cache_size', 128))
     item.__isqdef__ = True
+    # Pure operations only apply gates, so loops of them can be lifted.
+    if kwargs.get('pure', False):
+      item.__ispure__ = True
     return item
 
   return _decorator
@@ -24,9 +32,17 @@ def qdef(*args, **kwargs):
 #TODO: This and other classes should be abstract class and the whole Qiskit
 # implementation should be injected.
 class AllOneControl:
-  def __init__(self, *values: 'Qubits'):
+  """Qubits controlling an operation. The operation applies when they hold
+  `ctrl_state`, read with the first qubit as the least significant bit,
+  which defaults to all of them being one."""
+
+  def __init__(
+    self, *values: 'Qubits', ancilla: Sequence['Qubits'] = (),
+    ctrl_state: Optional[int] = None):
     assert len(values), 'At least one piece of data is needed to control upon it'
     self.values = values
+    self.ancilla = tuple(ancilla)
+    self._ctrl_state = ctrl_state
 
   @overload
   def __and__(self, other: 'Qubits') -> 'AllOneControl': ...
@@ -35,9 +51,35 @@ class AllOneControl:
   def __and__(self, other: 'AllOneControl') -> 'AllOneControl': ...
 
   def __and__(self, other: Union['Qubits', 'AllOneControl']) -> 'AllOneControl':
-    if not isinstance(other, AllOneControl):
-      other = AllOneControl(other)
-    return AllOneControl(*(*self.values, *other.values))
+    other = _as_control(other)
+    return AllOneControl(
+      *(*self.values, *other.values), ancilla=(*self.ancilla, *other.ancilla),
+      ctrl_state=self.ctrl_state | other.ctrl_state << self.width)
+
+  def using(self, *ancilla: 'Qubits') -> 'AllOneControl':
+    """Make clean ancilla qubits available to the multi-controlled gate
+    decompositions. They are returned to |0> after every use."""
+    return AllOneControl(
+      *self.values, ancilla=(*self.ancilla, *ancilla),
+      ctrl_state=self._ctrl_state)
+
+  @property
+  def width(self) -> int:
+    return sum(len(value) for value in self.values)
+
+  @property
+  def ctrl_state(self) -> int:
+    if self._ctrl_state is None:
+      return 2**self.width - 1
+    return self._ctrl_state
+
+  @property
+  def qiskit_qubits(self) -> List[bp.Qubit]:
+    return list(chain(*(value.qiskit_qubits for value in self.values)))
+
+  @property
+  def ancilla_qubits(self) -> List[bp.Qubit]:
+    return list(chain(*(value.qiskit_qubits for value in self.ancilla)))
 
 
 @dataclass
@@ -46,34 +88,92 @@ class QComparison:
 
   integer: int
 
+  def control(self) -> AllOneControl:
+    """Control on the qubits holding the integer."""
+    assert 0 <= self.integer < 2**len(self.qubits),\
+      f'{self.integer} does not fit in {len(self.qubits)} qubits'
+    return AllOneControl(self.qubits, ctrl_state=self.integer)
+
+@dataclass
+class RegisterComparison:
+  left: 'Qubits'
+
+  right: 'Qubits'
+
+  @contextmanager
+  def difference(self):
+    """XOR both registers into ancilla from the allocation pool, which hold
+    zeros only where the registers are equal, and uncompute them on exit."""
+    allocation = bp.current_allocation()
+    circuit = allocation.circuit
+    pool = allocation.ancilla_pool
+    pairs = list(zip(self.left.qiskit_qubits, self.right.qiskit_qubits))
+    difference = pool.acquire(len(pairs))
+    for (left, right), target in zip(pairs, difference):
+      bp.append(circuit, CXGate(), [left, target])
+      bp.append(circuit, CXGate(), [right, target])
+    yield Qubits(allocation, difference)
+    for (left, right), target in reversed(list(zip(pairs, difference))):
+      bp.append(circuit, CXGate(), [right, target])
+      bp.append(circuit, CXGate(), [left, target])
+    # The block is only controlled on the difference, so it is restored.
+    pool.release(difference, uncomputed=True)
+
 QiskitQubits = Union[bp.QuantumRegister, List[bp.Qubit]]
 
 
+QubitIndices = Union[range, Tuple[int, ...]]
+
+
 class Qubits:
+  """View over some qubits of an allocation, kept as their positions in the
+  qubit table of the allocation: a `range` when they are evenly spaced, as
+  registers and their slices are, or a tuple otherwise. Slicing a range is
+  O(1), and Qiskit qubits are only looked up when emitting gates."""
+
+  __slots__ = ('allocation', 'indices')
 
   allocation: 'Allocation'
 
-  qiskit_qubits: List[bp.Qubit]
+  indices: QubitIndices
 
   def __init__(self, allocation: 'Allocation', qiskit_qubits: QiskitQubits):
     self.allocation = allocation
-    self.qiskit_qubits = [*qiskit_qubits]
+    self.indices = allocation.qubit_indices(qiskit_qubits)
+
+  @classmethod
+  def view(cls, allocation: 'Allocation', indices: QubitIndices) -> 'Qubits':
+    qubits = cls.__new__(cls)
+    qubits.allocation = allocation
+    qubits.indices = indices
+    return qubits
+
+  @property
+  def qiskit_qubits(self) -> List[bp.Qubit]:
+    table = self.allocation.qubit_table
+    indices = self.indices
+    if isinstance(indices, range) and indices.step > 0:
+      return table[indices.start:indices.stop:indices.step]
+    return [table[index] for index in indices]
 
   def __len__(self):
-    return len(self.qiskit_qubits)
+    return len(self.indices)
 
   def __getitem__(self, item):
+    indices = self.indices[item]
     if not isinstance(item, slice):
-      return Qubits(self.allocation, [self.qiskit_qubits[item]])
+      indices = range(indices, indices + 1)
+    return Qubits.view(self.allocation, indices)
 
-    return Qubits(self.allocation, self.qiskit_qubits[item])
+  def __iter__(self) -> Iterator['Qubits']:
+    for index in self.indices:
+      yield Qubits.view(self.allocation, range(index, index + 1))
 
   def __add__(self, more_data):
-    return Qubits(
-      self.allocation, [*self.qiskit_qubits, *more_data.qiskit_qubits])
+    return _concatenate(self.allocation, (self, more_data))
 
-  def __and__(self, other: 'Qubits') -> AllOneControl:
-    return AllOneControl(self, other)
+  def __and__(self, other: Union['Qubits', AllOneControl]) -> AllOneControl:
+    return AllOneControl(self) & other
 
   def all_ones_value(self) -> int:
     return 2**len(self) - 1
@@ -81,13 +181,43 @@ class Qubits:
   def is_max_value(self):
     return self == self.all_ones_value()
 
+  def equals(self, another: 'Qubits') -> RegisterComparison:
+    """Compare the values of two registers of the same size in a quantum if."""
+    if len(self) != len(another):
+      raise ValueError(
+        f'Only registers of the same size can be compared, not {len(self)}'
+        f' and {len(another)} qubits')
+    return RegisterComparison(self, another)
+
   def __eq__(self, another: object) -> Union[QComparison, bool]:
-    # TODO: Add support for comparing two registers. May require extending
-    # the allocation with ancilla. Should be transparent for the user.
     if isinstance(another, int):
       return QComparison(self, another)
 
-    return super().__eq__(another)
+    # Otherwise, views are equal if they are the same qubits.
+    if isinstance(another, Qubits):
+      return self.allocation is another.allocation\
+        and len(self.indices) == len(another.indices)\
+        and tuple(self.indices) == tuple(another.indices)
+
+    return NotImplemented
+
+  def __hash__(self):
+    return hash((id(self.allocation), tuple(self.indices)))
+
+def _concatenate(allocation: 'Allocation', parts: Iterable[Qubits]) -> Qubits:
+  parts = [part for part in parts if len(part)]
+  assert all(part.allocation is allocation for part in parts),\
+    'Only qubits of the same allocation can be concatenated'
+  if all(isinstance(part.indices, range) and part.indices.step == 1 for part in parts)\
+    and all(
+      previous.indices.stop == part.indices.start
+      for previous, part in zip(parts, parts[1:])):
+    # Adjacent ranges, like consecutive registers, stay a range.
+    start = parts[0].indices.start if parts else 0
+    return Qubits.view(allocation, range(start, start + sum(map(len, parts))))
+
+  return Qubits.view(
+    allocation, tuple(chain.from_iterable(part.indices for part in parts)))
 
 class Functor:
   pass
@@ -114,16 +244,191 @@ class Adjoint(Functor):
       return getattr(operation.__self__, operation.__adj__.__name__)
     return operation.__adj__
 
-from qiskit.extensions.standard.x import XGate
+class CachedOperation:
+  """Operation recording its body into a gate once per call signature.
+
+  The signature is made of the shape of the quantum arguments (including
+  which qubits they share) and the value of the classical ones. Later calls
+  with the same signature append the recorded gate instead of replaying the
+  body. Adjoint and controlled variants are derived from the recorded gate.
+  Calls with unhashable classical arguments or holding qubits other than
+  through `Qubits` (such as controls), and bodies returning values,
+  measuring or allocating ancilla, run uncached. The gates are shared by the
+  threads calling the operation."""
+
+  def __init__(self, operation: Callable, maxsize: int = 128):
+    update_wrapper(self, operation)
+    self._operation = operation
+    self._maxsize = maxsize
+    self._gates: OrderedDict = OrderedDict()
+    self._lock = Lock()
+
+  def __setattr__(self, name, value):
+    if name in ('__adj__', '__ctl__') and not isinstance(value, _CachedVariant):
+      value = _CachedVariant(self, name, value)
+    super().__setattr__(name, value)
+
+  def __get__(self, instance, owner=None):
+    if instance is None:
+      return self
+    return MethodType(self, instance)
+
+  def __call__(self, *args, **kwargs):
+    return self._apply(self._operation, args, kwargs)
+
+  def _apply(self, fallback, args, kwargs, inverse=False, control=None):
+    signature = _call_signature(args, kwargs)
+    if signature is None:
+      return _call_fallback(fallback, args, kwargs, control)
+
+    key, qubits = signature
+    gate = self._lookup((key, inverse, _control_key(control)))
+    if gate is None:
+      gate = self._build(key, args, kwargs, len(qubits), inverse, control)
+    if gate is False:
+      return _call_fallback(fallback, args, kwargs, control)
+
+    control_qubits = [] if control is None else _as_control(control).qiskit_qubits
+    bp.append(bp.current_allocation().circuit, gate, [*control_qubits, *qubits])
+
+  def _build(self, key, args, kwargs, width, inverse, control):
+    gate = self._lookup((key, False, None))
+    if gate is None:
+      gate = _record(self._operation, args, kwargs, width)
+      self._store((key, False, None), gate)
+    if gate is False:
+      return False
+
+    if inverse:
+      gate = gate.inverse()
+    if control is not None and _as_control(control).width > 0:
+      control = _as_control(control)
+      gate = gate.control(control.width, ctrl_state=control.ctrl_state)
+    self._store((key, inverse, _control_key(control)), gate)
+    return gate
+
+  def _lookup(self, key):
+    with self._lock:
+      gate = self._gates.get(key)
+      if gate is not None:
+        self._gates.move_to_end(key)
+      return gate
+
+  def _store(self, key, gate):
+    with self._lock:
+      self._gates[key] = gate
+      if len(self._gates) > self._maxsize:
+        self._gates.popitem(last=False)
+
+
+class _CachedVariant:
+  """Adjoint or controlled variant of a `CachedOperation`. ``fallback`` is
+  the generated implementation, used when the call cannot be cached."""
+
+  __isqdef__ = True
+
+  def __init__(self, operation: CachedOperation, kind: str, fallback: Callable):
+    self._operation = operation
+    self._kind = kind
+    self._fallback = fallback
+    self.__name__ = fallback.__name__
+
+  def __getattr__(self, name):
+    return getattr(self._fallback, name)
+
+  def __call__(self, *args, **kwargs):
+    if self._kind == '__adj__':
+      return self._operation._apply(self._fallback, args, kwargs, inverse=True)
+
+    control, *args = args
+    return self._operation._apply(
+      self._fallback, tuple(args), kwargs, control=control)
+
+
+def _call_signature(args, kwargs):
+  positions: MutableMapping[bp.Qubit, int] = {}
+  key = []
+  for name, value in chain(enumerate(args), sorted(kwargs.items())):
+    if isinstance(value, Qubits):
+      key.append((name, tuple(
+        positions.setdefault(qubit, len(positions))
+        for qubit in value.qiskit_qubits)))
+      continue
+
+    # Other arguments holding qubits cannot be keyed by value nor rebound
+    # to the recording.
+    if _holds_qubits(value):
+      return None
+
+    try:
+      hash(value)
+    except TypeError:
+      return None
+    key.append((name, value))
+
+  if not positions:
+    return None
+
+  return tuple(key), list(positions)
+
+def _holds_qubits(value) -> bool:
+  if isinstance(value, (Qubits, AllOneControl, QComparison, RegisterComparison)):
+    return True
+  if isinstance(value, (tuple, frozenset)):
+    return any(_holds_qubits(item) for item in value)
+  return False
+
+def _call_fallback(fallback, args, kwargs, control):
+  if control is None:
+    return fallback(*args, **kwargs)
+  return fallback(control, *args, **kwargs)
+
+def _control_key(control) -> Optional[Tuple[int, int]]:
+  if control is None:
+    return None
+  control = _as_control(control)
+  return control.width, control.ctrl_state
+
+def _as_control(control) -> 'AllOneControl':
+  if isinstance(control, Qubits):
+    return AllOneControl(control)
+  return control
+
+def _record(operation, args, kwargs, width):
+  recording = Allocation(width)
+  register, = recording.circuit.qregs
+  positions: MutableMapping[bp.Qubit, int] = {}
+
+  def _rebind(value):
+    if not isinstance(value, Qubits):
+      return value
+    # The register of the recording is the whole of its qubit table.
+    return Qubits.view(recording, tuple(
+      positions.setdefault(qubit, len(positions))
+      for qubit in value.qiskit_qubits))
+
+  args = [_rebind(value) for value in args]
+  kwargs = {name: _rebind(value) for name, value in sorted(kwargs.items())}
+  with recording:
+    result = operation(*args, **kwargs)
+
+  circuit = recording.circuit
+  if result is not None or len(circuit.qregs) > 1 or len(circuit.cregs):
+    return False
+
+  circuit.name = operation.__name__
+  return circuit.to_gate()
+
+from qiskit.extensions.standard.x import XGate, CXGate
 
 @qdef
 def X(q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.x(q.qiskit_qubits)
+  bp.broadcast(bp.current_allocation().circuit, XGate(), q.qiskit_qubits)
 
 @qdef
 def _X_ctl(control: Union[AllOneControl, Qubits], q: Qubits):
   #TODO: Provide a decorator for adding the proper runtime signature checks.
-  _multiplexed_control(XGate(), control, q)
+  _all_ones_control(XGate(), control, q)
 
 bp.wire_functors(X, X, _X_ctl)
 
@@ -131,12 +436,12 @@ from qiskit.extensions.standard.h import HGate
 
 @qdef
 def H(q: Qubits):
-    bp.__ALLOCATIONS__[-1].circuit.h(q.qiskit_qubits)
+    bp.broadcast(bp.current_allocation().circuit, HGate(), q.qiskit_qubits)
 
 @qdef
 def _H_ctl(control: Union[AllOneControl, Qubits], q: Qubits):
   #TODO: Provide a decorator for adding the proper runtime signature checks.
-  _multiplexed_control(HGate(), control, q)
+  _all_ones_control(HGate(), control, q)
 
 bp.wire_functors(H, H, _H_ctl)
 
@@ -144,19 +449,20 @@ from qiskit.extensions.standard.u1 import U1Gate
 
 @qdef
 def R1(angle: float, q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.u1(angle, q.qiskit_qubits)
+  bp.broadcast(bp.current_allocation().circuit, U1Gate(angle), q.qiskit_qubits)
 
 @qdef
 def _R1_adj(angle: float, q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.append(U1Gate(angle).inverse(), [q.qiskit_qubits])
+  bp.broadcast(
+    bp.current_allocation().circuit, U1Gate(angle).inverse(), q.qiskit_qubits)
 
 @qdef
 def _R1_adj_ctl(control: Union[AllOneControl, Qubits], angle: float, q: Qubits):
-  _multiplexed_control(U1Gate(angle).inverse(), control, q)
+  _all_ones_control(U1Gate(angle).inverse(), control, q)
 
 @qdef
 def _R1_ctl(control: Union[AllOneControl, Qubits], angle: float, q: Qubits):
-  _multiplexed_control(U1Gate(angle), control, q)
+  _all_ones_control(U1Gate(angle), control, q)
 
 bp.wire_functors(R1, _R1_adj, _R1_ctl, _R1_adj_ctl)
 
@@ -164,11 +470,11 @@ from qiskit.extensions.standard.z import ZGate
 
 @qdef
 def Z(q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.z(q.qiskit_qubits)
+  bp.broadcast(bp.current_allocation().circuit, ZGate(), q.qiskit_qubits)
 
 @qdef
 def _Z_ctl(control: Union[AllOneControl, Qubits], q: Qubits):
-  _multiplexed_control(ZGate(), control, q)
+  _all_ones_control(ZGate(), control, q)
 
 bp.wire_functors(Z, Z, _Z_ctl)
 
@@ -176,38 +482,123 @@ from qiskit.extensions.standard.rx import RXGate
 
 @qdef
 def RX(theta: float, q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.rx(theta, q.qiskit_qubits)
+  bp.broadcast(bp.current_allocation().circuit, RXGate(theta), q.qiskit_qubits)
 
 @qdef
 def _RX_adj(theta: float, q: Qubits):
-  bp.__ALLOCATIONS__[-1].circuit.append(RXGate(theta).inverse(), [q.qiskit_qubits])
+  bp.broadcast(
+    bp.current_allocation().circuit, RXGate(theta).inverse(), q.qiskit_qubits)
 
 @qdef
 def _RX_ctl(control: Union[AllOneControl, Qubits], angle: float, q: Qubits):
-  _multiplexed_control(RXGate(angle), control, q)
+  _all_ones_control(RXGate(angle), control, q)
 
 def _RX_adj_ctl(control: Union[AllOneControl, Qubits], angle: float, q: Qubits):
-  _multiplexed_control(RXGate(angle).inverse(), control, q)
+  _all_ones_control(RXGate(angle).inverse(), control, q)
 
 bp.wire_functors(RX, _RX_adj, _RX_ctl, _RX_adj_ctl)
 
-from qiskit.extensions.standard.iden import IdGate
+# Gates only append to the current allocation, so `bp.repeat` can lift loops
+# applying them.
+for _gate in (
+  X, _X_ctl, H, _H_ctl, R1, _R1_adj, _R1_ctl, _R1_adj_ctl, Z, _Z_ctl,
+  RX, _RX_adj, _RX_ctl, _RX_adj_ctl):
+  _gate.__ispure__ = True
+
+import cmath
+from math import pi
+from qiskit.circuit.library import MCXGate, MCXVChain, MCXRecursive
+from qiskit.extensions.standard.ry import RYGate
 from qiskit.extensions.quantum_initializer.ucg import UCG
-
-def _multiplexed_control(gate, control: Union[AllOneControl, Qubits], target: Qubits):
-  # TODO: Now not considering the order because this is being controlled by
-  # the all 1s sequence.
-  if isinstance(control, Qubits):
-    control = AllOneControl(control)
-
-  control_qubits = tuple(chain(
-    *(value.qiskit_qubits for value in control.values)))
-  control_patterns_count = 2 ** len(control_qubits)
-  gate_list = [
-    IdGate().to_matrix()
-    for _ in range(control_patterns_count - 1)] + [gate.to_matrix()]
-  bp.__ALLOCATIONS__[-1].circuit.append(
-    UCG(gate_list, False), (target.qiskit_qubits, ) + control_qubits)
+from qiskit.extensions.standard.i import IGate
+from qiskit.quantum_info import Operator
+
+def _all_ones_control(gate, control: Union[AllOneControl, Qubits], target: Qubits):
+  control = _as_control(control)
+  allocation = bp.current_allocation()
+  circuit = allocation.circuit
+  control_qubits = control.qiskit_qubits
+  if not control_qubits:
+    # Qiskit cannot control on zero qubits, and the gate applies always.
+    bp.broadcast(circuit, gate, target.qiskit_qubits)
+    return
+
+  ancilla_qubits = control.ancilla_qubits
+  if len(ancilla_qubits) < len(control_qubits) - 2:
+    # The decompositions can borrow the released ancilla known to be clean.
+    busy = {*control_qubits, *target.qiskit_qubits, *ancilla_qubits}
+    ancilla_qubits += [
+      qubit for qubit in allocation.ancilla_pool.clean_qubits
+      if qubit not in busy]
+  emit = _ALL_ONES_EMITTERS.get(gate.name, _emit_controlled)
+  for target_qubit in target.qiskit_qubits:
+    emit(
+      circuit, gate, control_qubits, control.ctrl_state, target_qubit,
+      ancilla_qubits)
+
+# Open controls are passed to the gates as their control state, instead of
+# conjugating the controls with X gates.
+
+def _emit_controlled(circuit, gate, controls, state, target, ancillas):
+  bp.append(
+    circuit, gate.control(len(controls), ctrl_state=state), [*controls, target])
+
+def _emit_mcx(circuit, gate, controls, state, target, ancillas):
+  count = len(controls)
+  if count > 2 and len(ancillas) >= count - 2:
+    bp.append(
+      circuit, MCXVChain(count, ctrl_state=state),
+      [*controls, target, *ancillas[:count - 2]])
+  elif count > 4 and len(ancillas) > 0:
+    bp.append(
+      circuit, MCXRecursive(count, ctrl_state=state),
+      [*controls, target, ancillas[0]])
+  else:
+    bp.append(circuit, MCXGate(count, ctrl_state=state), [*controls, target])
+
+def _emit_mcz(circuit, gate, controls, state, target, ancillas):
+  _emit_controlled(circuit, U1Gate(pi), controls, state, target, ancillas)
+
+def _emit_mch(circuit, gate, controls, state, target, ancillas):
+  # H = RY(pi/4)·Z·RY(-pi/4), and the rotations cancel when not controlled.
+  bp.append(circuit, RYGate(-pi/4), [target])
+  _emit_mcz(circuit, gate, controls, state, target, ancillas)
+  bp.append(circuit, RYGate(pi/4), [target])
+
+_ALL_ONES_EMITTERS = {
+  'x': _emit_mcx,
+  'z': _emit_mcz,
+  'h': _emit_mch,
+}
+
+def _multiplexed_control(gates, control_qubits, target: Qubits):
+  """Apply a uniformly controlled gate: ``gates[pattern]`` is applied on the
+  target when the controls hold ``pattern``. Only use it for actual
+  multiplexors: single-pattern controls go through `_all_ones_control`."""
+  assert len(gates) == 2 ** len(control_qubits),\
+    'A multiplexor needs one gate per control pattern'
+  circuit = bp.current_allocation().circuit
+  gate_list = [Operator(gate).data for gate in gates]
+  multiplexor = UCG(gate_list, False)
+  # The decomposition is exact up to a global phase only, and the phase
+  # becomes relative once the multiplexor is recorded in a branch or in a
+  # cached operation that gets controlled, so it is undone explicitly.
+  phase = _global_phase(Operator(multiplexor).data, gate_list[0])
+  for target_qubit in target.qiskit_qubits:
+    bp.append(circuit, multiplexor, [target_qubit, *control_qubits])
+    if abs(phase) > 1E-12:
+      # U1(phase) on |1> and, between the X gates, on |0>.
+      for gate in (U1Gate(phase), XGate(), U1Gate(phase), XGate()):
+        bp.append(circuit, gate, [target_qubit])
+
+def _global_phase(decomposed, first_gate) -> float:
+  """Phase to multiply the `decomposed` multiplexor by for its first block
+  to match `first_gate`. The target is its least significant qubit, so the
+  first block is the top-left 2x2 corner."""
+  row, column = max(
+    ((row, column) for row in range(2) for column in range(2)),
+    key=lambda entry: abs(first_gate[entry]))
+  return cmath.phase(first_gate[row, column] / decomposed[row, column])
 
 def head(l: list):
   return l[0]
@@ -225,44 +616,189 @@ class Allocation:
 
   qubits: Tuple[Qubits, ...]
 
+  measurement_proxies: MutableMapping[Tuple[bp.Qubit, ...], MeasurementProxy]
+
+  ancilla_pool: 'AncillaPool'
+
+  qubit_table: List[bp.Qubit]
+
   def __init__(self, *sizes: int):
     registers = bp.new_registers(*sizes)
-    circuit = bp.new_circuit_with_registers(registers)
-    self.circuit = circuit
-    self.qubits = tuple(map(partial(Qubits, self), registers))
+    self.circuit = bp.new_circuit_with_registers(registers)
+    self.qubit_table = []
+    self._qubit_positions: MutableMapping[bp.Qubit, int] = {}
+    self.qubits = tuple(
+      Qubits.view(self, self._extend_table(register)) for register in registers)
+    self.measurement_proxies = {}
+    self.ancilla_pool = AncillaPool(self)
+
+  def add_register(self, register: bp.QuantumRegister) -> Qubits:
+    self.circuit.add_register(register)
+    return Qubits.view(self, self._extend_table(register))
+
+  def qubit_indices(self, qiskit_qubits: QiskitQubits) -> Tuple[int, ...]:
+    return tuple(self._qubit_positions[qubit] for qubit in qiskit_qubits)
+
+  def _extend_table(self, register: bp.QuantumRegister) -> range:
+    start = len(self.qubit_table)
+    for qubit in register:
+      self._qubit_positions[qubit] = len(self.qubit_table)
+      self.qubit_table.append(qubit)
+    return range(start, len(self.qubit_table))
 
   def __enter__(self):
-    bp.__ALLOCATIONS__.append(self)
+    bp.push_allocation(self)
     return self
 
   def __exit__(self, *_):
-    bp.__ALLOCATIONS__.pop()
+    bp.pop_allocation()
+    self.measurement_proxies.clear()
+
+  async def __aenter__(self):
+    return self.__enter__()
+
+  async def __aexit__(self, *exc_info):
+    return self.__exit__(*exc_info)
 
   def __iter__(self) -> Iterable[Qubits]:
     return iter(self.qubits)
 
 
-# TODO: Should allow for managing and **reusing** ancilla qubits.
+class AncillaPool:
+  """Ancilla qubits of an allocation. Released qubits are expected to be back
+  in |0> and are handed out again before adding new qubits to the circuit,
+  so the width of the circuit follows the peak of ancilla in use at the same
+  time rather than the total of ancilla requested.
+
+  Qubits are only known to be clean while they are new, after being reset,
+  or after checking they were uncomputed since they were known to be clean.
+  Only the clean ones are lent to the decompositions of multi-controlled
+  gates."""
+
+  def __init__(self, allocation: Allocation):
+    self._allocation = allocation
+    self._circuit = allocation.circuit
+    self._free: List[bp.Qubit] = []
+    self._clean: Set[bp.Qubit] = set()
+    self.width = 0
+    self.in_use = 0
+    self.peak_width = 0
+
+  @property
+  def free_qubits(self) -> List[bp.Qubit]:
+    return list(reversed(self._free))
+
+  @property
+  def clean_qubits(self) -> List[bp.Qubit]:
+    return [qubit for qubit in reversed(self._free) if qubit in self._clean]
+
+  def acquire(self, size: int) -> List[bp.Qubit]:
+    qubits = [self._free.pop() for _ in range(min(size, len(self._free)))]
+    missing = size - len(qubits)
+    if missing:
+      register, = bp.new_registers(missing)
+      new_qubits = self._allocation.add_register(register).qiskit_qubits
+      self._clean.update(new_qubits)
+      qubits.extend(new_qubits)
+      self.width += missing
+
+    self.in_use += size
+    self.peak_width = max(self.peak_width, self.in_use)
+    return qubits
+
+  def release(
+    self, qubits: List[bp.Qubit], reset: bool = False, check: bool = False,
+    start: int = 0, uncomputed: bool = False):
+    """Return `qubits` to the pool. With `reset`, they are reset to |0>.
+    With `check`, the operations appended since `start` are simulated to
+    assert they were uncomputed. `uncomputed` tells the caller restored
+    them by construction."""
+    if check:
+      _assert_uncomputed(self._circuit, qubits, start)
+    if reset and qubits:
+      self._circuit.reset(qubits)
+      self._clean.update(qubits)
+    elif not check and not uncomputed:
+      self._clean.difference_update(qubits)
+    self._free.extend(reversed(qubits))
+    self.in_use -= len(qubits)
+
+
+def _assert_uncomputed(
+  circuit: bp.QuantumCircuit, qubits: List[bp.Qubit], start: int = 0):
+  """Assert the operations appended since `start` return `qubits` to |0>
+  from |0>, whatever the state of the other qubits they act on. Those start
+  maximally entangled with reference qubits, measurements are deferred onto
+  fresh environment qubits and resets swap with them."""
+  from qiskit.quantum_info import Statevector
+  from qiskit.extensions.standard.swap import SwapGate
+  instructions = circuit.data[start:]
+  wires = {qubit: index for index, qubit in enumerate(qubits)}
+  for _, qargs, _ in instructions:
+    for qubit in qargs:
+      wires.setdefault(qubit, len(wires))
+  inputs = range(len(qubits), len(wires))
+  environment = len(wires) + len(inputs)
+
+  operations = []
+  for instruction, qargs, _ in instructions:
+    targets = [wires[qubit] for qubit in qargs]
+    if instruction.condition is not None:
+      raise ValueError(
+        f'Cannot check the uncomputation of ancilla after a conditional {instruction.name}')
+    if instruction.name == 'barrier':
+      continue
+    if instruction.name == 'measure':
+      operations.append((CXGate(), [targets[0], environment]))
+      environment += 1
+    elif instruction.name == 'reset':
+      operations.append((SwapGate(), [targets[0], environment]))
+      environment += 1
+    elif isinstance(instruction, bp.Gate):
+      operations.append((instruction, targets))
+    else:
+      raise ValueError(
+        f'Cannot check the uncomputation of ancilla after {instruction.name}')
+
+  block = bp.QuantumCircuit(environment)
+  for wire in inputs:
+    block.h(wire)
+    block.cx(wire, wire + len(inputs))
+  for instruction, targets in operations:
+    bp.append(block, instruction, [block.qubits[target] for target in targets])
+
+  probability = Statevector.from_instruction(block).probabilities(
+    range(len(qubits)))[0]
+  assert abs(probability - 1) < 1E-6,\
+    f'Ancilla qubits were not uncomputed (probability of |0> is {probability})'
+
+
 class AncillaExtension:
 
   allocation: Allocation
 
   qubits: Tuple[Qubits, ...]
 
-  def __init__(self, allocation: Allocation, *sizes: int):
-    registers = bp.new_registers(*sizes)
-    allocation.circuit.add_register(*registers)
+  def __init__(self, allocation: Allocation, *sizes: int, reset: bool = False, check: bool = False):
+    pool = allocation.ancilla_pool
     self.allocation = allocation
-    self.qubits = tuple(map(partial(Qubits, self), registers))
+    self.qubits = tuple(Qubits(allocation, pool.acquire(size)) for size in sizes)
+    self._reset = reset
+    self._check = check
+    self._start = len(allocation.circuit.data)
+    self._released = False
 
   def __enter__(self):
     return self
 
   def __exit__(self, *_):
-    # TODO: Add an option for resetting the qubits. Tracking these and returning
-    # them enables reusing. Not sure if adding this or let the compiler to take
-    # care.
-    pass
+    if self._released:
+      return
+
+    self._released = True
+    qubits = list(chain(*(value.qiskit_qubits for value in self.qubits)))
+    self.allocation.ancilla_pool.release(
+      qubits, reset=self._reset, check=self._check, start=self._start)
 
   def __iter__(self) -> Iterable[Qubits]:
     return iter(self.qubits)
@@ -270,24 +806,30 @@ class AncillaExtension:
 def allocation(*sizes: int) -> Allocation:
   return Allocation(*sizes)
 
-def ancilla(*sizes: int) -> AncillaExtension:
-  return AncillaExtension(bp.__ALLOCATIONS__[-1], *sizes)
+def batch() -> bp.Batch:
+  return bp.Batch()
 
-_MEASUREMENT_PROXY_CACHE: MutableMapping[object, MeasurementProxy] = {}
+def ancilla(*sizes: int, reset: bool = False, check: bool = False) -> AncillaExtension:
+  """Borrow ancilla qubits from the current allocation. They must be back in
+  |0> when leaving the block, unless `reset` is set; with `check`, this is
+  asserted by simulating the circuit."""
+  return AncillaExtension(bp.current_allocation(), *sizes, reset=reset, check=check)
 
 def measure(register: Qubits) -> MeasurementProxy:
   if isinstance(register, Allocation):
-    register = sum((r for r in register), Qubits(register, []))
+    register = _concatenate(register, register.qubits)
+  allocation = bp.current_allocation()
+  proxies = allocation.measurement_proxies
   key = (*register.qiskit_qubits,)
-  if not key in _MEASUREMENT_PROXY_CACHE:
-    circuit = bp.__ALLOCATIONS__[-1].circuit
+  if not key in proxies:
+    circuit = allocation.circuit
     cregister = bp.ClassicalRegister(len(register))
     qregister = register.qiskit_qubits
     circuit.add_register(cregister)
     circuit.measure(qregister, cregister)
-    _MEASUREMENT_PROXY_CACHE[key] = MeasurementProxy(circuit, qregister, cregister)
+    proxies[key] = MeasurementProxy(circuit, qregister, cregister)
 
-  return _MEASUREMENT_PROXY_CACHE[key]
+  return proxies[key]
 
 
 # TODO: Reinterpreted Python builtins
@@ -316,24 +858,158 @@ bp.wire_functors(map, _map_adj, _map_ctl, _map_adj_ctl)
 
 @qdef
 @contextmanager
-def superposition(comp: QComparison):
-  yield from _map_on_zero_valued_indices(X, comp)
+def superposition(comp: Union[QComparison, RegisterComparison]):
+  if isinstance(comp, RegisterComparison):
+    with comp.difference() as difference:
+      yield AllOneControl(difference, ctrl_state=0)
+    return
+
+  yield comp.control()
 
 @qdef
-@contextmanager
-def _superposition_ctl(control: Qubits, comp: QComparison):
-  yield from _map_on_zero_valued_indices(partial(X.__ctl__, control), comp)
+def _superposition_ctl(
+  control: Union[AllOneControl, Qubits],
+  comp: Union[QComparison, RegisterComparison]):
+  # The operations in the block are already controlled on `control` too,
+  # since the translation merges it into their controls.
+  return superposition(comp)
 
 bp.wire_functors(superposition, superposition, _superposition_ctl)
 
-def _map_on_zero_valued_indices(gate, comp: QComparison):
-  qubits = comp.qubits
-  int_binarystring = bin(comp.integer)[2:].rjust(len(qubits), '0')
-  for stage in ['enter', 'exit']:
-    # set/unset anticontrols
-    for index, char in enumerate(reversed(int_binarystring)):
-      if char == '0':
-        gate(qubits[index])
-
-    if stage == 'enter':
-      yield qubits
\ No newline at end of file
+
+class SuperpositionCases:
+  """Branches of a quantum if with elif/else clauses, all comparing the same
+  qubits. The body of each branch is recorded into a gate instead of being
+  applied, and the branches are applied together as the cases of one
+  multiplexor when leaving `superposition_cases`."""
+
+  qubits: Qubits
+
+  integers: List[int]
+
+  def __init__(self, *comparisons: QComparison):
+    for comparison in comparisons:
+      if isinstance(comparison, RegisterComparison):
+        raise TypeError(
+          'Quantum ifs with elif clauses cannot compare two registers,'
+          ' nest them inside the else clause instead')
+      if not isinstance(comparison, QComparison):
+        raise TypeError(
+          'Quantum ifs with elif or else clauses must compare qubits with'
+          f' integers or two registers, not {type(comparison).__name__}')
+    self.qubits = comparisons[0].qubits
+    assert all(
+      comparison.qubits.qiskit_qubits == self.qubits.qiskit_qubits
+      for comparison in comparisons),\
+      'The elif clauses of a quantum if must compare the same qubits'
+    self.integers = [comparison.control().ctrl_state for comparison in comparisons]
+    self._cases: MutableMapping[int, _Block] = {}
+    self._otherwise: _Block = None
+
+  @contextmanager
+  def case(self, index: int):
+    block = yield from _recorded_block('case')
+    # Like in Python, a repeated test never takes its branch.
+    self._cases.setdefault(self.integers[index], block)
+
+  @contextmanager
+  def otherwise(self):
+    self._otherwise = yield from _recorded_block('otherwise')
+
+  def apply(self):
+    circuit = bp.current_allocation().circuit
+    controls = self.qubits.qiskit_qubits
+    # Empty cases stay in `_cases`, so their patterns do not take the else
+    # branch: they apply the identity.
+    cases = self._cases
+    blocks = [
+      block for block in [*cases.values(), self._otherwise]
+      if block is not None]
+    assert all(set(controls).isdisjoint(qubits) for _, qubits in blocks),\
+      'The branches of a quantum if cannot act on the compared qubits'
+
+    if self._is_multiplexable(blocks):
+      target = blocks[0][1]
+      default = self._otherwise[0] if self._otherwise else IGate()
+      _multiplexed_control(
+        [(cases[pattern] or (IGate(),))[0] if pattern in cases else default
+         for pattern in range(2**len(controls))],
+        controls, Qubits(self.qubits.allocation, target))
+      return
+
+    # The else branch applies everywhere, and each case undoes it first.
+    if self._otherwise:
+      bp.append(circuit, *self._otherwise)
+    for integer, block in cases.items():
+      if self._otherwise:
+        otherwise, otherwise_qubits = self._otherwise
+        instructions = [(otherwise.inverse(), otherwise_qubits, [])]
+        if block is not None:
+          instructions.append((block[0], block[1], []))
+        block = bp.gate_from_instructions(instructions, 'case')
+      if block is None:
+        continue
+      gate, qubits = block
+      bp.append(
+        circuit, gate.control(len(controls), ctrl_state=integer),
+        [*controls, *qubits])
+
+  def _is_multiplexable(self, blocks: List['_Block']) -> bool:
+    """Use a multiplexor, whose cost grows with the number of control
+    patterns, when all branches are single-qubit gates on the same qubit and
+    there are enough of them."""
+    control_count = len(self.qubits)
+    return len(blocks) > 0\
+      and all(qubits == blocks[0][1] and len(qubits) == 1 for _, qubits in blocks)\
+      and 2**control_count <= len(blocks) * control_count
+
+
+_Block = Optional[Tuple[bp.Gate, List[bp.Qubit]]]
+
+def _recorded_block(name: str):
+  """Run the body of a `with` block and take its instructions out of the
+  circuit. Yields once, and returns the gate applying
+  them and its qubits, or None if the block is empty."""
+  circuit = bp.current_allocation().circuit
+  start = len(circuit.data)
+  yield
+  instructions = circuit.data[start:]
+  del circuit.data[start:]
+  if not instructions:
+    return None
+
+  if len(instructions) == 1 and not instructions[0][2]:
+    instruction, qargs, _ = instructions[0]
+    if isinstance(instruction, bp.Gate) and instruction.condition is None:
+      return instruction, list(qargs)
+
+  block = bp.gate_from_instructions(instructions, name)
+  assert block is not None,\
+    'The branches of a quantum if can only apply unitary gates'
+  return block
+
+@qdef
+@contextmanager
+def superposition_cases(*comparisons: Union[QComparison, RegisterComparison]):
+  if len(comparisons) == 1 and isinstance(comparisons[0], RegisterComparison):
+    # Like in `superposition`, the branches are the cases of the difference
+    # of both registers being all zeros or not.
+    with comparisons[0].difference() as difference:
+      cases = SuperpositionCases(QComparison(difference, 0))
+      yield cases
+      cases.apply()
+    return
+
+  cases = SuperpositionCases(*comparisons)
+  yield cases
+  cases.apply()
+
+@qdef
+def _superposition_cases_ctl(
+  control: Union[AllOneControl, Qubits],
+  *comparisons: Union[QComparison, RegisterComparison]):
+  # As with `superposition`, the operations in the branches are already
+  # controlled on `control`.
+  return superposition_cases(*comparisons)
+
+bp.wire_functors(superposition_cases, superposition_cases, _superposition_cases_ctl)
\ No newline at end of file
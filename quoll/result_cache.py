@@ -0,0 +1,266 @@
+"""
+Cache of execution results across runs. Circuits are keyed by a canonical
+hash of their gates, parameters and register layout, which leaves out the
+register names Quoll generates, together with the backend id and its
+options. Results are kept as outcome tables in a memory LRU and, bounded in
+size, on disk.
+"""
+import io
+import zipfile
+import hashlib
+import dataclasses
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate, Gate, Instruction
+from qiskit.providers.jobstatus import JobStatus
+
+import quoll
+import quoll.config
+from quoll.disk_cache import DiskCache
+from quoll.measurements import Execution, OutcomeTable
+from quoll.simulator import SimulationResult, _format_memory
+
+_TABLE_SUFFIX = '.npz'
+
+
+@dataclass
+class CacheStatistics:
+
+  memory_hits: int = 0
+
+  disk_hits: int = 0
+
+  misses: int = 0
+
+  stores: int = 0
+
+  @property
+  def hits(self) -> int:
+    return self.memory_hits + self.disk_hits
+
+  @property
+  def hit_rate(self) -> float:
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+
+class ResultCache(DiskCache):
+  """Result cache shared by the threads executing circuits. The memory LRU
+  and the statistics are guarded by a lock, while the disk entries are
+  written atomically."""
+
+  suffixes = (_TABLE_SUFFIX,)
+
+  memory_size: int
+
+  statistics: CacheStatistics
+
+  def __init__(self, memory_size: int, directory: str, max_size: int):
+    super().__init__(directory, max_size)
+    self.memory_size = memory_size
+    self.statistics = CacheStatistics()
+    self._memory: 'OrderedDict[str, OutcomeTable]' = OrderedDict()
+    self._lock = Lock()
+
+  def key(self, circuit: QuantumCircuit, backend_id: str, options) -> Optional[str]:
+    """Key of running `circuit` on a backend, or None if the circuit has
+    unbound parameters and cannot be cached."""
+    digest = hashlib.sha256()
+    digest.update(repr((quoll.__version__, backend_id, dataclasses.astuple(options))).encode('utf-8'))
+    try:
+      digest.update(_circuit_digest(circuit))
+    except TypeError:
+      return None
+    return digest.hexdigest()
+
+  def get(self, key: str) -> Optional[OutcomeTable]:
+    with self._lock:
+      table = self._memory.get(key)
+      if table is not None:
+        self._memory.move_to_end(key)
+        self.statistics.memory_hits += 1
+        return table
+
+    table = self._load(key)
+    with self._lock:
+      if table is None:
+        self.statistics.misses += 1
+        return None
+
+      self.statistics.disk_hits += 1
+      self._remember(key, table)
+    return table
+
+  def put(self, key: str, table: OutcomeTable):
+    with self._lock:
+      self.statistics.stores += 1
+      self._remember(key, table)
+    # Outcomes wider than 63 bits are Python integers, which cannot be
+    # stored without pickling, so they are only kept in memory.
+    if table.outcomes.dtype != object:
+      self._write(key, {_TABLE_SUFFIX: _dump_table(table)})
+
+  def submit(
+    self, circuits: Sequence[QuantumCircuit],
+    submit: Callable[[List[QuantumCircuit]], object]) -> 'CachedJob':
+    """Look up the results of `circuits` and `submit` only the missing ones."""
+    backend_id = quoll.config.get_backend_id()
+    options = quoll.config.get_backend_options()
+    keys = [self.key(circuit, backend_id, options) for circuit in circuits]
+    tables = [None if key is None else self.get(key) for key in keys]
+    missing = [index for index, table in enumerate(tables) if table is None]
+    job = submit([circuits[index] for index in missing]) if missing else None
+    return CachedJob(self, circuits, keys, tables, missing, job)
+
+  def clear(self):
+    """Forget the results kept in memory. Entries on disk stay."""
+    with self._lock:
+      self._memory.clear()
+
+  def _remember(self, key: str, table: OutcomeTable):
+    """Keep `table` in the memory LRU. The caller holds the lock."""
+    self._memory[key] = table
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.memory_size:
+      self._memory.popitem(last=False)
+
+  def _load(self, key: str) -> Optional[OutcomeTable]:
+    data = self._read(key, _TABLE_SUFFIX)
+    if data is None:
+      return None
+
+    try:
+      with np.load(io.BytesIO(data)) as arrays:
+        return OutcomeTable(
+          arrays['outcomes'], arrays['weights'],
+          arrays['sizes'].tolist(), bool(arrays['exact']))
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+      return None
+
+
+class CachedJob:
+  """Job combining cached outcome tables with the results of the circuits
+  that were missing from the cache, which are stored once they arrive."""
+
+  def __init__(self, cache: ResultCache, circuits, keys, tables, missing, job):
+    self._cache = cache
+    self._circuits = list(circuits)
+    self._keys = keys
+    self._tables: List[Optional[OutcomeTable]] = tables
+    self._missing = missing
+    self._job = job
+    self._result: Optional[SimulationResult] = None
+
+  def status(self) -> JobStatus:
+    return JobStatus.DONE if self._job is None else self._job.status()
+
+  def result(self) -> SimulationResult:
+    if self._result is None:
+      self._store_missing()
+      self._result = SimulationResult(
+        self._circuits,
+        [None if table.exact else _counts(table) for table in self._tables],
+        self._tables)
+    return self._result
+
+  def _store_missing(self):
+    if self._job is None:
+      return
+
+    result = self._job.result()
+    for position, index in enumerate(self._missing):
+      table = Execution(
+        self._circuits[index], result, experiment=position).outcomes
+      self._tables[index] = table
+      if self._keys[index] is not None:
+        self._cache.put(self._keys[index], table)
+    self._job = None
+
+
+def _circuit_digest(circuit: QuantumCircuit) -> bytes:
+  qubits = {qubit: index for index, qubit in enumerate(circuit.qubits)}
+  clbits = {clbit: index for index, clbit in enumerate(circuit.clbits)}
+  digest = hashlib.sha256()
+  digest.update(repr((
+    [register.size for register in circuit.qregs],
+    [register.size for register in circuit.cregs])).encode('utf-8'))
+
+  definitions: Dict[int, bytes] = {}
+  for instruction, qargs, cargs in circuit.data:
+    condition = None
+    if instruction.condition is not None:
+      register, value = instruction.condition
+      condition = (circuit.cregs.index(register), value)
+    digest.update(_instruction_digest(instruction, definitions))
+    digest.update(repr((
+      [qubits[qubit] for qubit in qargs],
+      [clbits[clbit] for clbit in cargs],
+      condition)).encode('utf-8'))
+  return digest.digest()
+
+def _instruction_digest(instruction: Instruction, definitions: Dict[int, bytes]) -> bytes:
+  """Hash of what an instruction does. Standard gates are identified by
+  their name and parameters, while gates built from circuits, whose names
+  Quoll may reuse, are hashed through their definition."""
+  if id(instruction) in definitions:
+    return definitions[id(instruction)]
+
+  digest = hashlib.sha256()
+  digest.update(repr((
+    instruction.name, instruction.num_qubits, instruction.num_clbits,
+    getattr(instruction, 'ctrl_state', None))).encode('utf-8'))
+  for param in instruction.params:
+    digest.update(_param_digest(param))
+
+  if isinstance(instruction, ControlledGate):
+    digest.update(_instruction_digest(instruction.base_gate, definitions))
+  elif type(instruction) in (Gate, Instruction) and instruction.definition:
+    for operation, qargs, cargs in instruction.definition:
+      digest.update(_instruction_digest(operation, definitions))
+      digest.update(repr((
+        [qubit.index for qubit in qargs],
+        [clbit.index for clbit in cargs])).encode('utf-8'))
+
+  definitions[id(instruction)] = digest.digest()
+  return definitions[id(instruction)]
+
+def _param_digest(param) -> bytes:
+  if isinstance(param, np.ndarray):
+    return repr((param.dtype.str, param.shape)).encode('utf-8') + param.tobytes()
+  if isinstance(param, (int, float, complex, np.number, str)):
+    return repr(param).encode('utf-8')
+  # Unbound parameters do not determine the result.
+  raise TypeError(f'Parameter {param!r} cannot be hashed')
+
+def _dump_table(table: OutcomeTable) -> bytes:
+  buffer = io.BytesIO()
+  np.savez(
+    buffer, outcomes=table.outcomes, weights=table.weights,
+    sizes=np.array(table.sizes, dtype=np.int64), exact=np.array(table.exact))
+  return buffer.getvalue()
+
+def _counts(table: OutcomeTable) -> Dict[str, int]:
+  return {
+    _format_memory(int(outcome), table.sizes): int(weight)
+    for outcome, weight in zip(table.outcomes, table.weights)}
+
+
+_CACHE: Optional[ResultCache] = None
+
+def get_result_cache() -> Optional[ResultCache]:
+  global _CACHE
+  options = quoll.config.get_result_cache_options()
+  if not options.enabled:
+    return None
+
+  if _CACHE is None or _CACHE.directory != options.directory\
+    or _CACHE.max_size != options.max_size\
+    or _CACHE.memory_size != options.memory_size:
+    _CACHE = ResultCache(options.memory_size, options.directory, options.max_size)
+
+  return _CACHE
@@ -0,0 +1,354 @@
+"""
+Local statevector simulator for small allocations. It applies the gates of
+the circuits straight to a NumPy array, without transpiling nor assembling
+them, and samples all the shots at once when the measurements are terminal.
+Select it with `-b quoll:statevector`.
+
+With the `exact` backend option, the outcome probabilities are computed from
+the amplitudes instead of sampling shots. This also works with Qiskit
+statevector simulators.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate, Gate, Instruction
+from qiskit.circuit.exceptions import CircuitError
+from qiskit.providers.jobstatus import JobStatus
+
+import qiskit
+
+import quoll.config
+import quoll.boilerplate as bp
+from quoll.measurements import OutcomeTable
+
+# Outcomes less likely than this are numerical noise.
+_NEGLIGIBLE_PROBABILITY = 1E-12
+
+
+class QuollProvider:
+
+  def __init__(self):
+    self._backends = {'statevector': StatevectorSimulator()}
+
+  def get_backend(self, name: str) -> 'StatevectorSimulator':
+    if name not in self._backends:
+      raise ValueError(f'No backend with name {name} in the quoll provider')
+    return self._backends[name]
+
+  def backends(self) -> List['StatevectorSimulator']:
+    return list(self._backends.values())
+
+
+class SimulationResult:
+  """Counts, or exact outcome tables, of a list of simulated circuits, looked
+  up like in a Qiskit result: by position, by circuit or by circuit name."""
+
+  def __init__(
+    self, circuits: Sequence[QuantumCircuit],
+    counts: Sequence[Optional[Dict[str, int]]],
+    outcome_tables: Optional[Sequence[Optional[OutcomeTable]]] = None):
+    self._circuits = list(circuits)
+    self._counts = list(counts)
+    self._outcome_tables = list(outcome_tables or [None] * len(self._circuits))
+
+  def get_counts(self, experiment: Union[int, str, QuantumCircuit, None] = None) -> Dict[str, int]:
+    counts = self._counts[self._index(experiment)]
+    if counts is None:
+      raise ValueError('The experiment was computed exactly and has no counts.')
+    return counts
+
+  def get_outcome_table(self, experiment: Union[int, str, QuantumCircuit, None] = None) -> Optional[OutcomeTable]:
+    return self._outcome_tables[self._index(experiment)]
+
+  def _index(self, experiment) -> int:
+    if experiment is None:
+      assert len(self._circuits) == 1, 'Specify the experiment.'
+      return 0
+
+    if isinstance(experiment, int):
+      return experiment
+
+    for index, circuit in enumerate(self._circuits):
+      # Circuit equality compares the DAGs, so look for the same object.
+      if circuit is experiment or circuit.name == experiment:
+        return index
+
+    raise KeyError(f'No experiment {experiment} in the result')
+
+
+class SimulationJob:
+  """Already finished job, since the simulation runs on submission."""
+
+  def __init__(self, result: SimulationResult):
+    self._result = result
+
+  def status(self) -> JobStatus:
+    return JobStatus.DONE
+
+  def result(self) -> SimulationResult:
+    return self._result
+
+
+class ExactJob:
+  """Job of a Qiskit statevector simulator running the circuits without
+  their measurements. Its result holds the exact outcome tables of the
+  original circuits."""
+
+  def __init__(self, job, circuits: Sequence[QuantumCircuit], measurements: Sequence[list]):
+    self._job = job
+    self._circuits = circuits
+    self._measurements = measurements
+
+  def status(self) -> JobStatus:
+    return self._job.status()
+
+  def result(self) -> SimulationResult:
+    result = self._job.result()
+    outcome_tables = [
+      _outcome_table(circuit, np.asarray(result.get_statevector(index)), measurements)
+      for index, (circuit, measurements)
+      in enumerate(zip(self._circuits, self._measurements))]
+    return SimulationResult(
+      self._circuits, [None] * len(self._circuits), outcome_tables)
+
+
+class StatevectorSimulator:
+
+  name = 'statevector'
+
+  def run_circuits(
+    self, circuits: Sequence[QuantumCircuit],
+    options: quoll.config.BackendOptions) -> SimulationJob:
+    rng = np.random.default_rng(options.seed_simulator)
+    counts = []
+    outcome_tables = []
+    for circuit in circuits:
+      outcome_table = _exact_outcome_table(circuit) if options.exact else None
+      outcome_tables.append(outcome_table)
+      counts.append(
+        None if outcome_table is not None
+        else _counts(circuit, _simulate(circuit, options.shots, rng)))
+
+    return SimulationJob(SimulationResult(circuits, counts, outcome_tables))
+
+  def __str__(self):
+    return self.name
+
+
+class _Wires:
+  """Positions of the qubits and classical bits of a circuit. Qubit `i` is
+  bit `i` of the basis state index, hence axis `n - 1 - i` of the state."""
+
+  def __init__(self, circuit: QuantumCircuit):
+    self.width = circuit.num_qubits
+    self.qubits = {qubit: index for index, qubit in enumerate(circuit.qubits)}
+    self.clbits = {clbit: index for index, clbit in enumerate(circuit.clbits)}
+
+  def axes(self, qargs) -> List[int]:
+    return [self.width - 1 - self.qubits[qubit] for qubit in qargs]
+
+
+def run_exactly(backend, circuits: Sequence[QuantumCircuit], options: quoll.config.BackendOptions) -> Optional[ExactJob]:
+  """Run the circuits without measurements in a Qiskit statevector simulator,
+  or return `None` if some of them has measurements that are not terminal."""
+  unitary_circuits = []
+  measurements = []
+  for circuit in circuits:
+    gates, circuit_measurements = _split_terminal_measurements(circuit)
+    if gates is None or circuit.num_clbits >= 63:
+      return None
+
+    unitary_circuit = QuantumCircuit(*circuit.qregs, name=circuit.name)
+    for instruction, qargs, _ in gates:
+      unitary_circuit.append(instruction, qargs)
+    unitary_circuits.append(unitary_circuit)
+    measurements.append(circuit_measurements)
+
+  kwargs = options.execute_kwargs()
+  kwargs['shots'] = 1
+  job = qiskit.execute(
+    unitary_circuits, backend=backend, basis_gates=bp.BASIS_GATES, **kwargs)
+  return ExactJob(job, circuits, measurements)
+
+def _simulate(circuit: QuantumCircuit, shots: int, rng: np.random.Generator) -> np.ndarray:
+  """Return the classical memory of every shot, as integers."""
+  wires = _Wires(circuit)
+  gates, measurements = _split_terminal_measurements(circuit)
+  if gates is None or len(wires.clbits) >= 63:
+    return np.array([_run_shot(circuit, wires, rng) for _ in range(shots)])
+
+  probabilities = np.abs(_final_state(wires, gates).reshape(-1)) ** 2
+  outcomes = rng.choice(
+    probabilities.size, size=shots, p=probabilities / probabilities.sum())
+  return _memory(outcomes, wires, measurements)
+
+def _exact_outcome_table(circuit: QuantumCircuit) -> Optional[OutcomeTable]:
+  gates, measurements = _split_terminal_measurements(circuit)
+  if gates is None or circuit.num_clbits >= 63:
+    return None
+
+  return _outcome_table(
+    circuit, _final_state(_Wires(circuit), gates), measurements)
+
+def _outcome_table(circuit: QuantumCircuit, state: np.ndarray, measurements) -> OutcomeTable:
+  """Exact outcome table of measuring a state, in one pass over the
+  probabilities of all the basis states."""
+  probabilities = np.abs(state.reshape(-1)) ** 2
+  memory = _memory(
+    np.arange(probabilities.size, dtype=np.int64), _Wires(circuit), measurements)
+  outcomes, inverse = np.unique(memory, return_inverse=True)
+  weights = np.bincount(inverse, weights=probabilities)
+  likely = weights > _NEGLIGIBLE_PROBABILITY
+  return OutcomeTable(
+    outcomes[likely], weights[likely] / weights[likely].sum(),
+    [register.size for register in circuit.cregs], exact=True)
+
+def _final_state(wires: _Wires, gates) -> np.ndarray:
+  state = _initial_state(wires.width)
+  for instruction, qargs, _ in gates:
+    state = _apply(state, instruction, wires.axes(qargs))
+  return state
+
+def _memory(outcomes: np.ndarray, wires: _Wires, measurements) -> np.ndarray:
+  """Classical memory after measuring each of the basis state `outcomes`."""
+  memory = np.zeros(outcomes.size, dtype=np.int64)
+  for qubit, clbit in measurements:
+    bits = (outcomes >> wires.qubits[qubit]) & 1
+    memory = (memory & ~(1 << wires.clbits[clbit])) | (bits << wires.clbits[clbit])
+  return memory
+
+def _split_terminal_measurements(circuit: QuantumCircuit):
+  """Split the circuit into its gates and its final measurements, or return
+  `None` if it needs to be simulated shot by shot."""
+  gates = []
+  measurements = []
+  measured = set()
+  for instruction, qargs, cargs in circuit.data:
+    if instruction.condition is not None or instruction.name == 'reset':
+      return None, None
+
+    if instruction.name == 'measure':
+      measurements.append((qargs[0], cargs[0]))
+      measured.add(qargs[0])
+    elif instruction.name == 'barrier':
+      continue
+    elif measured.intersection(qargs) or cargs:
+      return None, None
+    else:
+      gates.append((instruction, qargs, cargs))
+
+  return gates, measurements
+
+def _run_shot(circuit: QuantumCircuit, wires: _Wires, rng: np.random.Generator) -> int:
+  state = _initial_state(wires.width)
+  memory = 0
+  for instruction, qargs, cargs in circuit.data:
+    if instruction.condition is not None:
+      register, value = instruction.condition
+      register_value = sum(
+        ((memory >> wires.clbits[clbit]) & 1) << position
+        for position, clbit in enumerate(register))
+      if register_value != value:
+        continue
+
+    if instruction.name == 'barrier':
+      continue
+
+    if instruction.name in ('measure', 'reset'):
+      axis, = wires.axes(qargs[:1])
+      state, outcome = _collapse(state, axis, rng)
+      if instruction.name == 'reset':
+        if outcome:
+          state = np.flip(state, axis)
+      else:
+        clbit = wires.clbits[cargs[0]]
+        memory = (memory & ~(1 << clbit)) | (outcome << clbit)
+      continue
+
+    state = _apply(state, instruction, wires.axes(qargs))
+
+  return memory
+
+def _collapse(state: np.ndarray, axis: int, rng: np.random.Generator) -> Tuple[np.ndarray, int]:
+  one = np.take(state, 1, axis=axis)
+  probability_of_one = float(np.sum(np.abs(one) ** 2) / np.sum(np.abs(state) ** 2))
+  outcome = int(rng.random() < probability_of_one)
+  index = [slice(None)] * state.ndim
+  index[axis] = 1 - outcome
+  state = state.copy()
+  state[tuple(index)] = 0
+  return state / np.linalg.norm(state), outcome
+
+def _initial_state(width: int) -> np.ndarray:
+  state = np.zeros((2,) * width, dtype=np.complex128)
+  state[(0,) * width] = 1
+  return state
+
+def _apply(state: np.ndarray, instruction: Instruction, axes: List[int]) -> np.ndarray:
+  """Apply a gate acting on the given axes of the state."""
+  if isinstance(instruction, ControlledGate) and instruction.base_gate is not None:
+    return _apply_controlled(state, instruction, axes)
+
+  matrix = _matrix(instruction)
+  if matrix is not None:
+    return _apply_matrix(state, matrix, axes)
+
+  if instruction.definition is None:
+    raise ValueError(f'Cannot simulate the instruction {instruction.name}')
+
+  for sub_instruction, qargs, _ in instruction.definition:
+    state = _apply(state, sub_instruction, [axes[qubit.index] for qubit in qargs])
+  return state
+
+def _apply_controlled(state: np.ndarray, gate: ControlledGate, axes: List[int]) -> np.ndarray:
+  # Only the slice where the controls hold the control state changes. The
+  # rest of qubits of the gate, if any, are ancilla the gate leaves alone.
+  control_count = gate.num_ctrl_qubits
+  control_axes = axes[:control_count]
+  index = [slice(None)] * state.ndim
+  for position, axis in enumerate(control_axes):
+    index[axis] = (gate.ctrl_state >> position) & 1
+
+  target_axes = [
+    axis - sum(1 for control_axis in control_axes if control_axis < axis)
+    for axis in axes[control_count:control_count + gate.base_gate.num_qubits]]
+  view = state[tuple(index)]
+  view[...] = _apply(view, gate.base_gate, target_axes)
+  return state
+
+def _apply_matrix(state: np.ndarray, matrix: np.ndarray, axes: List[int]) -> np.ndarray:
+  # The first qubit of a gate is the least significant bit of its matrix,
+  # so it corresponds to the last axis of the reshaped matrix.
+  size = len(axes)
+  tensor = matrix.reshape((2,) * (2 * size))
+  state_axes = list(reversed(axes))
+  state = np.tensordot(tensor, state, axes=(list(range(size, 2 * size)), state_axes))
+  return np.moveaxis(state, list(range(size)), state_axes)
+
+def _matrix(instruction: Instruction) -> Optional[np.ndarray]:
+  if not isinstance(instruction, Gate):
+    return None
+  try:
+    return instruction.to_matrix()
+  except CircuitError:
+    # Composite gates have no matrix but a definition.
+    return None
+
+def _counts(circuit: QuantumCircuit, memory: np.ndarray) -> Dict[str, int]:
+  values, frequencies = np.unique(memory, return_counts=True)
+  sizes = [register.size for register in circuit.cregs]
+  return {
+    _format_memory(int(value), sizes): int(frequency)
+    for value, frequency in zip(values, frequencies)}
+
+def _format_memory(value: int, sizes: Sequence[int]) -> str:
+  # Like Qiskit, registers are separated by spaces with the first one on
+  # the right.
+  bits = format(value, f'0{sum(sizes)}b') if sum(sizes) else ''
+  registers = []
+  end = len(bits)
+  for size in sizes:
+    registers.append(bits[end - size:end])
+    end -= size
+  return ' '.join(reversed(registers))
@@ -0,0 +1,84 @@
+"""
+Persistent cache of translated Quoll modules. Entries are keyed by the hash
+of the source, the module path and its modification time, the Quoll version,
+the transpiler itself and the compilation flags, so it does not depend on
+`__pycache__` being writable.
+"""
+import marshal
+import hashlib
+from importlib.util import MAGIC_NUMBER
+from types import CodeType
+from typing import Optional
+
+import quoll
+import quoll.config
+import quoll.transpiler
+from quoll.disk_cache import DiskCache
+
+_CODE_SUFFIX = '.code'
+
+_PYTHON_SUFFIX = '.py'
+
+
+class TranslationCache(DiskCache):
+
+  suffixes = (_CODE_SUFFIX, _PYTHON_SUFFIX)
+
+  def key(self, data: bytes, path: str, mtime: float, *flags) -> str:
+    """Key of translating `data`, read from `path`. Like timestamp-based
+    bytecode, entries also go stale when the source is modified, even if
+    its contents end up the same."""
+    digest = hashlib.sha256()
+    for part in (
+      quoll.__version__, _transpiler_digest(), MAGIC_NUMBER, path,
+      repr(mtime), repr(flags)):
+      digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+      digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+  def get(self, key: str) -> Optional[CodeType]:
+    data = self._read(key, _CODE_SUFFIX)
+    if data is None:
+      return None
+
+    try:
+      return marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+      return None
+
+  def get_python(self, key: str) -> Optional[str]:
+    data = self._read(key, _PYTHON_SUFFIX)
+    return None if data is None else data.decode('utf-8')
+
+  def put(self, key: str, code: CodeType, python_source: Optional[str] = None):
+    entries = {_CODE_SUFFIX: marshal.dumps(code)}
+    if python_source is not None:
+      entries[_PYTHON_SUFFIX] = python_source.encode('utf-8')
+    self._write(key, entries)
+
+
+_TRANSPILER_DIGEST: Optional[bytes] = None
+
+def _transpiler_digest() -> bytes:
+  # Changes to the transpiler invalidate the entries even if the version
+  # number stays the same, as it happens during development.
+  global _TRANSPILER_DIGEST
+  if _TRANSPILER_DIGEST is None:
+    with open(quoll.transpiler.__file__, 'rb') as file_:
+      _TRANSPILER_DIGEST = hashlib.sha256(file_.read()).digest()
+  return _TRANSPILER_DIGEST
+
+_CACHE: Optional[TranslationCache] = None
+
+def get_translation_cache() -> Optional[TranslationCache]:
+  global _CACHE
+  options = quoll.config.get_translation_cache_options()
+  if not options.enabled:
+    return None
+
+  if _CACHE is None or _CACHE.directory != options.directory\
+    or _CACHE.max_size != options.max_size:
+    _CACHE = TranslationCache(options.directory, options.max_size)
+
+  return _CACHE
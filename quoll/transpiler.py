@@ -1,8 +1,11 @@
 from collections import defaultdict
-from typing import Any, List, Dict
+from contextlib import contextmanager
+from typing import Any, List, Dict, Optional
 import ast
-from ast import AST, dump, NodeTransformer, copy_location, Call, Name, Load, With, FunctionDef, NameConstant, Index, Subscript, arg, Expression, If, Suite, Attribute
+import gc
+from ast import AST, Compare, Eq, dump, NodeTransformer, copy_location, fix_missing_locations, iter_fields, Call, Name, Load, Store, With, FunctionDef, NameConstant, Index, Subscript, arg, Expression, If, Attribute, Assign, Await, BinOp, BitAnd, Constant, Expr, Import, Tuple, withitem, For, Slice, UnaryOp, expr_context, operator, unaryop
 from functools import partial
+from threading import Lock
 from dataclasses import dataclass, field
 
 from astpretty import pprint
@@ -43,51 +46,160 @@ class Translator(NodeTransformer):
     self._context = context
 
 
-class ControlledComputer(Translator):
+class VariantsComputer:
+  """Derive the adjoint and the controlled versions of some code in a single
+  traversal, building one copy of each node per requested variant. A variant
+  is not computed when its flag is off, and `None` is returned in its place.
+  """
 
-  def __init__(self, *args, control_param_name, **kwargs):
-    super().__init__(*args, **kwargs)
+  def __init__(self, adjoint: bool = False, control_param_name: Optional[str] = None):
+    self._adjoint = adjoint
     self._control_param_name = control_param_name
 
+  @property
+  def _controlled(self):
+    return self._control_param_name is not None
+
+  def visit(self, node):
+    if isinstance(node, list):
+      variants = [self.visit(item) for item in node]
+      return (
+        [adjoint for adjoint, _ in variants] if self._adjoint else None,
+        [controlled for _, controlled in variants] if self._controlled else None
+      )
+
+    if not isinstance(node, AST):
+      return node, node
+
+    visitor = getattr(self, f'visit_{node.__class__.__name__}', self.generic_visit)
+    return visitor(node)
+
+  def generic_visit(self, node):
+    fields = [(name, self.visit(value)) for name, value in iter_fields(node)]
+    adjoint = controlled = None
+    if self._adjoint:
+      adjoint = _rebuild(node, {name: value for name, (value, _) in fields})
+    if self._controlled:
+      controlled = _rebuild(node, {name: value for name, (_, value) in fields})
+    return adjoint, controlled
+
   def visit_Call(self, node: Call):
     if _is_operation_call(node):
-      node.func = copy_location(_wrap_in_controlled(node.func), node)
-      node.args.insert(0, copy_location(
-        Name(self._control_param_name, ctx=Load()), node.args[0]))
-      return node
-
-    if _is_variant_call(node):
-      functor_application = node.func
-      if _identify_signature(functor_application) == 'Id':
-        node.func = copy_location(_wrap_in_controlled(node.func), node)
-        node.args.insert(0, copy_location(
-          Name(self._control_param_name, ctx=Load()), node.args[0]))
+      adjoint = controlled = None
+      if self._adjoint:
+        adjoint = _clone(node)
+        adjoint.func = copy_location(_wrap_in_adjoint(adjoint.func), node)
+      if self._controlled:
+        controlled = _clone(node)
+        controlled.func = copy_location(_wrap_in_controlled(controlled.func), node)
+        controlled.args.insert(0, self._control_param(node))
+      return adjoint, controlled
+
+    adjoint, controlled = self.generic_visit(node)
+    if self._controlled and _is_variant_call(node):
+      if _identify_signature(node.func) == 'Id':
+        controlled.func = copy_location(_wrap_in_controlled(controlled.func), node)
+        controlled.args.insert(0, self._control_param(node))
 
       else:
-        node.args[0] = copy_location(_extend_control_data(
-          node.args[0], self._control_param_name), node.args[0])
+        controlled.args[0] = copy_location(_extend_control_data(
+          controlled.args[0], self._control_param_name), node.args[0])
+
+    return adjoint, controlled
+
+  def visit_For(self, node: For):
+    # The loop itself is classical: only its body gets the variants. The
+    # adjoint undoes the iterations in reverse order.
+    body_adjoint, body_controlled = self.visit(node.body)
+    adjoint = controlled = None
+    if self._adjoint:
+      body_adjoint.reverse()
+      iterations = _clone(node.iter)
+      if _uses_name(node.body, node.target):
+        iterations = copy_location(_reversed(iterations), node.iter)
+      adjoint = _rebuild(node, {
+        'target': _clone(node.target), 'iter': iterations, 'body': body_adjoint})
+    if self._controlled:
+      controlled = _rebuild(node, {
+        'target': _clone(node.target), 'iter': _clone(node.iter),
+        'body': body_controlled})
+    return adjoint, controlled
+
+  def visit_With(self, node: With):
+    adjoint, controlled = self.generic_visit(node)
+    # The adjoint undoes the block in reverse order. The cases of a quantum
+    # if keep theirs, which decides between repeated tests.
+    if adjoint is not None and not _is_cases(node):
+      adjoint.body.reverse()
+    return adjoint, controlled
 
-    self.generic_visit(node)
-    return node
+  def visit_If(self, node: If):
+    adjoint, controlled = self.generic_visit(node)
+    if adjoint is not None:
+      adjoint.body.reverse()
+      adjoint.orelse.reverse()
+    return adjoint, controlled
 
+  def visit_Subscript(self, node: Subscript):
+    if self._adjoint and _is_functor_application(node):
+      _, controlled = self.generic_visit(node) if self._controlled else (None, None)
+      return copy_location(_wrap_in_adjoint(_clone(node)), node), controlled
 
-class AdjointComputer(Translator):
+    return self.generic_visit(node)
 
-  def visit_Call(self, node):
-    if _is_operation_call(node):
-      node.func = copy_location(_wrap_in_adjoint(node.func), node)
-      return node
+  def _control_param(self, call: Call) -> Name:
+    location = call.args[0] if len(call.args) else call
+    return copy_location(_name(self._control_param_name), location)
 
-    self.generic_visit(node)
-    return node
 
-  def visit_Subscript(self, node):
-    if _is_functor_application(node):
-      return copy_location(_wrap_in_adjoint(node), node)
+def _rebuild(node: AST, fields: Dict[str, Any]) -> AST:
+  # Bypass the keyword constructor: copying the instance dictionary carries
+  # the location attributes along and is noticeably faster.
+  new_node = node.__class__.__new__(node.__class__)
+  new_node.__dict__.update(node.__dict__)
+  new_node.__dict__.update(fields)
+  return new_node
 
-    self.generic_visit(node)
+def _clone(node):
+  if isinstance(node, list):
+    return [_clone(item) for item in node]
+
+  if not isinstance(node, AST):
     return node
 
+  return _rebuild(
+    node, {name: _clone(value) for name, value in iter_fields(node)})
+
+
+# AST node factory
+
+def _name(name: str, ctx=None) -> Name:
+  return Name(id=name, ctx=ctx or Load())
+
+def _subscript(value: AST, index: AST) -> Subscript:
+  # Index() returns its value unwrapped since Python 3.9.
+  return Subscript(value=value, slice=Index(value=index), ctx=Load())
+
+def _slice_value(subscript: Subscript) -> AST:
+  if isinstance(subscript.slice, Index):
+    return subscript.slice.value
+  return subscript.slice
+
+def _call(func: AST, args: List[AST]) -> Call:
+  return Call(func=func, args=args, keywords=[])
+
+def _lambda(body: AST) -> ast.Lambda:
+  return ast.Lambda(
+    args=ast.arguments(
+      posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[],
+      kwarg=None, defaults=[]),
+    body=body)
+
+def _reversed(iterable: AST) -> Call:
+  # Ranges can be reversed in place, other iterables are listed first.
+  if not _is_range_call(iterable):
+    iterable = _call(_name('list'), [iterable])
+  return _call(_name('reversed'), [iterable])
 
 def _wrap_in_adjoint(node):
   return _wrap_in_functor(node, 'Adjoint')
@@ -96,14 +208,11 @@ def _wrap_in_controlled(node):
   return _wrap_in_functor(node, 'Controlled')
 
 def _wrap_in_functor(node, name):
-  wrapper = ast.parse(f'{name}[_]', mode='single').body[0].value
-  wrapper.slice.value = node
-  return wrapper
+  return _subscript(_name(name), node)
 
 def _extend_control_data(original_control_data_node, extension_name):
-  extended = ast.parse(f'(_) & {extension_name}').body[0].value
-  extended.left = original_control_data_node
-  return extended
+  return BinOp(
+    left=original_control_data_node, op=BitAnd(), right=_name(extension_name))
 
 def _is_operation_call(call):
   return isinstance(call.func, Name)
@@ -117,8 +226,7 @@ def _is_variant_call(call):
 def _is_functor_application(subscript):
   return isinstance(subscript.value, Name)\
     and subscript.value.id in ['Adjoint', 'Controlled']\
-    and isinstance(subscript.slice, Index)\
-    and isinstance(subscript.slice.value, (Name, Attribute))
+    and isinstance(_slice_value(subscript), (Name, Attribute))
 
 def _identify_signature(functor_application):
   if not isinstance(functor_application, Subscript):
@@ -128,7 +236,7 @@ def _identify_signature(functor_application):
     and functor_application.value.id == 'Controlled':
     return 'Controlled'
 
-  return _identify_signature(functor_application.slice)
+  return _identify_signature(_slice_value(functor_application))
 
 
 class BodyTranslator(Translator):
@@ -147,58 +255,104 @@ class BodyTranslator(Translator):
       node.body.insert(0, import_boilerplate)
 
     self.generic_visit(node)
-    return node
+    # Loops are lifted once the variants are derived from the original ones.
+    return LoopLifter(self._context).visit(node)
 
   def visit_With(self, node):
     if _is_allocation(node):
-      self._context.measurement_hoisting_table.append([])
-      self._context.allocation_context.append([])
-      self._context.allocation_context[-1] = [node.body, -1]
-      # Replace measurement calls with variables
-      for index, old_node in enumerate(node.body):
-        self._context.allocation_context[-1][1] = index
-        node.body[index] = self.visit(old_node)
-
-      # Create measurement proxies, execute and return measurements
-      new_nodes = []
-      proxy_to_measure_names = {}
-      for index, (_, m_node, m_name) in enumerate(self._context.measurement_hoisting_table[-1]):
-        proxy_name = f'_mp{index + 1}'
-        proxy_to_measure_names[proxy_name] = m_name
-        new_nodes.append(self._assign_proxy(m_node, proxy_name, node))
-
-      new_nodes.append(self._assign_measurements(proxy_to_measure_names, node))
-
-      # Insert at the proper point in the current allocation
-      hoisting_table = self._context.measurement_hoisting_table[-1]
-
-      # If there are measurements to hoist
-      if len(hoisting_table):
-        insertion_point = hoisting_table[0][0]
-        node.body[insertion_point:insertion_point] = new_nodes
-
-      self._context.allocation_context.pop()
-      self._context.measurement_hoisting_table.pop()
-      return node
+      return self._translate_allocation(node)
 
     self.generic_visit(node)
     return node
 
+  def visit_AsyncWith(self, node):
+    if _is_allocation(node):
+      return self._translate_allocation(node, is_async=True)
+
+    self.generic_visit(node)
+    return node
+
+  def _translate_allocation(self, node, is_async=False):
+    self._context.measurement_hoisting_table.append([])
+    self._context.allocation_context.append([])
+    self._context.allocation_context[-1] = [node.body, -1]
+    # Replace measurement calls with variables
+    for index, old_node in enumerate(node.body):
+      self._context.allocation_context[-1][1] = index
+      node.body[index] = self.visit(old_node)
+
+    # Create measurement proxies, execute and return measurements
+    new_nodes = []
+    proxy_to_measure_names = {}
+    for index, (_, m_node, m_name) in enumerate(self._context.measurement_hoisting_table[-1]):
+      proxy_name = f'_mp{index + 1}'
+      proxy_to_measure_names[proxy_name] = m_name
+      new_nodes.append(self._assign_proxy(m_node, proxy_name, node))
+
+    new_nodes.append(self._assign_measurements(proxy_to_measure_names, node, is_async))
+
+    # Insert at the proper point in the current allocation
+    hoisting_table = self._context.measurement_hoisting_table[-1]
+
+    # If there are measurements to hoist
+    if len(hoisting_table):
+      insertion_point = hoisting_table[0][0]
+      node.body[insertion_point:insertion_point] = new_nodes
+
+    self._context.allocation_context.pop()
+    self._context.measurement_hoisting_table.pop()
+    return node
+
   def visit_If(self, node: If):
+    if _is_control(node) and len(node.orelse):
+      return self._translate_cases(node)
+
     if _is_control(node):
       control_name = self._context.newname('__control')
-      # TODO: Add support for elif/else clauses
-      assert len(node.orelse) == 0, 'Still no support for elif/else clauses'
-      context_node = _control_context_node(node, control_name)
+      context_node = _control_context_node(
+        node, control_name, self._context.boilerplate_alias)
+      # Nested quantum ifs are translated first, so their controls get
+      # extended with this one.
       # TODO: Add support for a more general combination of things that happen
       # inside a Quoll statement or control what can appear in these structures
       # and fail when needed.
-      controlled_body = ControlledComputer(self._context, control_param_name=control_name).visit(Suite(node.body)).body
+      _, controlled_body = VariantsComputer(
+        control_param_name=control_name).visit(self._visit_suite(node.body))
       context_node.body = controlled_body
       return context_node
 
     return self.generic_visit(node)
 
+  def _translate_cases(self, node: If) -> With:
+    """Translate a quantum if with elif/else clauses into one multiplexed
+    construct. Branch bodies are not controlled here: the runtime records
+    each of them as one case of the multiplexor."""
+    comparisons, branches = [], []
+    while True:
+      comparisons.append(
+        _comparison(node.test.args[0], self._context.boilerplate_alias))
+      branches.append(node.body)
+      if len(node.orelse) == 1 and isinstance(node.orelse[0], If)\
+        and _is_control(node.orelse[0]):
+        node = node.orelse[0]
+        continue
+      # A classical elif is an else clause holding a classical if.
+      break
+
+    cases_name = self._context.newname('__cases')
+    body = [
+      _case_node(cases_name, 'case', [Constant(value=index)], self._visit_suite(branch))
+      for index, branch in enumerate(branches)]
+    if len(node.orelse):
+      body.append(
+        _case_node(cases_name, 'otherwise', [], self._visit_suite(node.orelse)))
+
+    return With(
+      items=[withitem(
+        context_expr=_call(_name('superposition_cases'), comparisons),
+        optional_vars=_name(cases_name, Store()))],
+      body=body)
+
   def visit_Call(self, node: Call):
     self.generic_visit(node)
     if _is_measurement(node):
@@ -214,19 +368,18 @@ class BodyTranslator(Translator):
   def visit_FunctionDef(self, node: FunctionDef):
     if _is_qdef(node):
       fix_location = partial(copy_location, old_node=node)
-      node.body = self.generic_visit(Suite(node.body)).body
+      node.body = self._visit_suite(node.body)
       new_nodes = [node]
-      if _auto_adjoint(node):
-        adjoint_implementation = fix_location(self._compute_adjoint(node))
-        adjoint_implementation.body.reverse()
-        new_nodes.append(adjoint_implementation)
+      adjoint_implementation, controlled_implementation = \
+        self._compute_variants(node)
+      if adjoint_implementation:
+        new_nodes.append(fix_location(adjoint_implementation))
         new_nodes.extend(
           map(fix_location, _wire_adjoints(node, adjoint_implementation))
         )
 
-      if _auto_controlled(node):
-        controlled_implementation = fix_location(self._compute_controlled(node))
-        new_nodes.append(controlled_implementation)
+      if controlled_implementation:
+        new_nodes.append(fix_location(controlled_implementation))
         new_nodes.extend(
           map(fix_location, _wire_controlled(node, controlled_implementation))
         )
@@ -236,41 +389,72 @@ class BodyTranslator(Translator):
     self.generic_visit(node)
     return node
 
-  def _compute_adjoint(self, node: FunctionDef):
-    import copy
-    adjoint = copy.deepcopy(node)
-    adjoint.name = f'{node.name}_adj'
-    if adjoint.name[0] != '_':
-      adjoint.name = f'_{adjoint.name}'
-    adjoint.decorator_list = []
-    AdjointComputer(self._context).visit(adjoint)
-    return adjoint
-
-  def _compute_controlled(self, node: FunctionDef):
-    import copy
-    adjoint = copy.deepcopy(node)
-    adjoint.name = f'{node.name}_ctl'
-    if adjoint.name[0] != '_':
-      adjoint.name = f'_{adjoint.name}'
-    control_param_name = self._context.newname('__control')
-    parameter_position = 0
-    if self._context.inside_class_body:
-      parameter_position = 1
-    adjoint.args.args.insert(
-      parameter_position, copy_location(arg(control_param_name, annotation=None), node))
-    adjoint.decorator_list = []
-    ControlledComputer(
-      self._context, control_param_name=control_param_name).visit(adjoint)
-    return adjoint
-
+  def _visit_suite(self, body: List[AST]) -> List[AST]:
+    new_body = []
+    for statement in body:
+      new_statement = self.visit(statement)
+      if isinstance(new_statement, AST):
+        new_body.append(new_statement)
+      elif new_statement is not None:
+        new_body.extend(new_statement)
+    return new_body
+
+  def _compute_variants(self, node: FunctionDef):
+    control_param_name = None
+    if _auto_controlled(node):
+      control_param_name = self._context.newname('__control')
+
+    computer = VariantsComputer(_auto_adjoint(node), control_param_name)
+    decorator_list, node.decorator_list = node.decorator_list, []
+    adjoint, controlled = computer.visit(node)
+    node.decorator_list = decorator_list
+
+    # The variants of pure operations are pure too.
+    for variant in (adjoint, controlled):
+      if variant and _is_pure(node):
+        variant.decorator_list = [Call(
+          func=_name('qdef'), args=[],
+          keywords=[ast.keyword(arg='pure', value=NameConstant(value=True))])]
+
+    if adjoint:
+      adjoint.name = _variant_name(node.name, 'adj')
+      adjoint.body.reverse()
+
+    if controlled:
+      controlled.name = _variant_name(node.name, 'ctl')
+      parameter_position = 0
+      if self._context.inside_class_body:
+        parameter_position = 1
+      controlled.args.args.insert(
+        parameter_position, copy_location(arg(control_param_name, annotation=None), node))
+
+    return adjoint, controlled
 
   def _assign_proxy(self, m_node: Call, proxy_name: str, node: Call):
     return copy_location(_assign_to_proxy(m_node, proxy_name), node)
 
-  def _assign_measurements(self, proxy_to_measure_names, node):
+  def _assign_measurements(self, proxy_to_measure_names, node, is_async=False):
     proxy_names = tuple(proxy_to_measure_names.keys())
     measure_names = tuple(proxy_to_measure_names.values())
-    return copy_location(_assign_to_measurements(self._context.boilerplate_alias, proxy_names, measure_names), node)
+    return copy_location(_assign_to_measurements(self._context.boilerplate_alias, proxy_names, measure_names, is_async), node)
+
+
+class LoopLifter(Translator):
+  """Rewrite loops only applying gates with loop-invariant arguments so they
+  are recorded once and repeated. See `quoll.boilerplate.repeat`."""
+
+  def visit_For(self, node: For):
+    self.generic_visit(node)
+    operations = _loop_invariant_operations(node)
+    if operations is not None:
+      repeat = Attribute(
+        value=_name(self._context.boilerplate_alias), attr='repeat', ctx=Load())
+      # The operations are only evaluated if the loop is lifted.
+      node.iter = copy_location(
+        _call(repeat, [node.iter, _lambda(Tuple(elts=operations, ctx=Load()))]),
+        node.iter)
+
+    return node
 
 
 def _is_qdef(node: FunctionDef):
@@ -280,22 +464,28 @@ def _is_qdef(node: FunctionDef):
     and node.decorator_list[-1].func.id == 'qdef'
 
 
+def _variant_name(name: str, suffix: str) -> str:
+  variant_name = f'{name}_{suffix}'
+  if variant_name[0] != '_':
+    variant_name = f'_{variant_name}'
+  return variant_name
+
 def _wire_adjoints(node: FunctionDef, adjoint_node: FunctionDef):
-  node_name = node.name
-  adjoint_node_name = adjoint_node.name
   return [
-    ast.parse(f'setattr({node_name}, \'__adj__\', {adjoint_node_name})').body[0],
-    ast.parse(f'setattr({adjoint_node_name}, \'__adj__\', {node_name})').body[0]
+    _set_functor(node.name, '__adj__', adjoint_node.name),
+    _set_functor(adjoint_node.name, '__adj__', node.name)
   ]
 
 def _wire_controlled(node: FunctionDef, controlled_node: FunctionDef):
-  node_name = node.name
-  controlled_node_name = controlled_node.name
   return [
-    ast.parse(f'setattr({node_name}, \'__ctl__\', {controlled_node_name})').body[0],
-    ast.parse(f'setattr({controlled_node_name}, \'__ctl__\', {controlled_node_name})').body[0]
+    _set_functor(node.name, '__ctl__', controlled_node.name),
+    _set_functor(controlled_node.name, '__ctl__', controlled_node.name)
   ]
 
+def _set_functor(operation_name: str, functor: str, variant_name: str) -> Expr:
+  return Expr(value=_call(
+    _name('setattr'),
+    [_name(operation_name), Constant(value=functor), _name(variant_name)]))
 
 
 def _auto_adjoint(node: FunctionDef):
@@ -304,6 +494,9 @@ def _auto_adjoint(node: FunctionDef):
 def _auto_controlled(node: FunctionDef):
   return _some_kw_match('ctl', True, node.decorator_list[-1].keywords)
 
+def _is_pure(node: FunctionDef):
+  return _some_kw_match('pure', True, node.decorator_list[-1].keywords)
+
 def _some_kw_match(name, value, kwargs):
   def id_is_adj(kw):
     return kw.arg == name and isinstance(kw.value, NameConstant) and kw.value.value == value
@@ -311,6 +504,62 @@ def _some_kw_match(name, value, kwargs):
   return any(map(id_is_adj, kwargs))
 
 
+def _loop_invariant_operations(node: For) -> Optional[List[AST]]:
+  """Return the operations called in a `for` loop over a `range()` whose body
+  only calls operations, or their variants, with loop-invariant arguments,
+  `None` otherwise. The loop is only lifted if `bp.repeat` finds all of them
+  marked as pure, since others may have side effects on every iteration."""
+  if not isinstance(node.target, Name) or node.orelse or not node.body\
+    or not _is_range_call(node.iter):
+    return None
+
+  loop_variable = node.target.id
+  operations = []
+  for statement in node.body:
+    if not isinstance(statement, Expr) or not isinstance(statement.value, Call):
+      return None
+
+    call = statement.value
+    arguments = [*call.args, *(keyword.value for keyword in call.keywords)]
+    if not _is_operation_reference(call.func)\
+      or not all(_is_invariant(argument, loop_variable) for argument in arguments)\
+      or not _is_invariant(call.func, loop_variable):
+      return None
+
+    operations.append(_clone(call.func))
+
+  return operations
+
+def _is_range_call(node: AST):
+  return isinstance(node, Call) and isinstance(node.func, Name)\
+    and node.func.id == 'range' and not node.keywords
+
+def _is_operation_reference(node: AST):
+  """Whether `node` names an operation, as in `op`, `self.op` or `Adjoint[op]`,
+  so it can be evaluated again without calling anything else."""
+  if isinstance(node, Subscript) and _is_functor_application(node):
+    return _is_operation_reference(_slice_value(node))
+  while isinstance(node, Attribute):
+    node = node.value
+  return isinstance(node, Name)
+
+def _uses_name(nodes: List[AST], target: AST) -> bool:
+  names = {child.id for child in ast.walk(target) if isinstance(child, Name)}
+  return any(
+    isinstance(child, Name) and child.id in names
+    for node in nodes for child in ast.walk(node))
+
+_INVARIANT_NODES = (
+  Name, Constant, Attribute, Subscript, Index, Slice, Tuple, UnaryOp, BinOp,
+  expr_context, operator, unaryop)
+
+def _is_invariant(node: AST, loop_variable: str):
+  return all(
+    isinstance(child, _INVARIANT_NODES)
+    and not (isinstance(child, Name) and child.id == loop_variable)
+    for child in ast.walk(node))
+
+
 def _is_measurement(node: Call):
   return isinstance(node.func, Name) and node.func.id == 'measure'
 
@@ -319,36 +568,96 @@ def _is_allocation(node: With):
   return isinstance(node.items[0].context_expr, Call) and isinstance(node.items[0].context_expr.func, Name) and node.items[0].context_expr.func.id == 'allocation'
 
 
+def _is_cases(node: With):
+  context = node.items[0].context_expr
+  return isinstance(context, Call) and isinstance(context.func, Name)\
+    and context.func.id == 'superposition_cases'
+
+
 def _is_control(node: If):
   return isinstance(node.test, Call) and isinstance(node.test.func, Name) and node.test.func.id == 'superposition'
 
 
 def _import_boilerplate(alias: str ='bp'):
-  return ast.parse(f'import quoll.boilerplate as {alias}', mode='single').body[0]
-
-
-def _control_context_node(node: If, control_param_name: str) -> With:
-  context_node = ast.parse(f'with superposition(_) as {control_param_name}: ...', mode='exec').body[0]
-  context_node.items[0].context_expr.args[0] = node.test.args[0]
-  return context_node
+  return Import(names=[ast.alias(name='quoll.boilerplate', asname=alias)])
+
+
+def _control_context_node(node: If, control_param_name: str, bp_alias: str) -> With:
+  context_expr = _call(
+    _name('superposition'), [_comparison(node.test.args[0], bp_alias)])
+  return With(
+    items=[withitem(
+      context_expr=context_expr,
+      optional_vars=_name(control_param_name, Store()))],
+    body=[])
+
+def _comparison(test: AST, bp_alias: str) -> AST:
+  """Replace `a == b` in the test of a quantum if with `bp.compare(a, b)`,
+  so registers are compared by value. Comparisons with literals keep `==`."""
+  if not isinstance(test, Compare) or len(test.ops) != 1\
+    or not isinstance(test.ops[0], Eq)\
+    or any(isinstance(side, Constant) for side in (test.left, *test.comparators)):
+    return test
+
+  compare = Attribute(value=_name(bp_alias), attr='compare', ctx=Load())
+  return copy_location(
+    _call(compare, [test.left, test.comparators[0]]), test)
+
+def _case_node(cases_name: str, method: str, args: List[AST], body: List[AST]) -> With:
+  method_node = Attribute(value=_name(cases_name), attr=method, ctx=Load())
+  return With(
+    items=[withitem(context_expr=_call(method_node, args), optional_vars=None)],
+    body=body)
 
 def _replace_measurement(name: str):
-  return ast.parse(name, mode='single').body[0].value
+  return _name(name)
 
 
 def _assign_to_proxy(m_node, proxy_name):
-  assign_node = ast.parse(f'{proxy_name} = _').body[0]
-  assign_node.value = m_node
-  return assign_node
-
-
-def _assign_to_measurements(bp_alias, proxy_names, measure_names):
-  last_comma = ',' if len(measure_names) == 1 else ''
-  return ast.parse(f'({", ".join(measure_names) + last_comma}) = {bp_alias}.execute({", ".join(proxy_names)})').body[0]
+  return Assign(targets=[_name(proxy_name, Store())], value=m_node)
+
+
+def _assign_to_measurements(bp_alias, proxy_names, measure_names, is_async=False):
+  targets = Tuple(
+    elts=[_name(name, Store()) for name in measure_names], ctx=Store())
+  execute = Attribute(
+    value=_name(bp_alias),
+    attr='execute_async' if is_async else 'execute', ctx=Load())
+  value = _call(execute, [_name(name) for name in proxy_names])
+  if is_async:
+    value = Await(value=value)
+  return Assign(targets=[targets], value=value)
+
+_GC_PAUSE_LOCK = Lock()
+
+_GC_PAUSES = 0
+
+_GC_WAS_ENABLED = False
+
+@contextmanager
+def _gc_paused():
+  # Syntax trees hold no reference cycles but allocate lots of nodes, which
+  # triggers full collections over the whole tree while it is being built.
+  # The collector is process-wide, so concurrent translations share one
+  # pause and the last one to finish restores the state found by the first.
+  global _GC_PAUSES, _GC_WAS_ENABLED
+  with _GC_PAUSE_LOCK:
+    if _GC_PAUSES == 0:
+      _GC_WAS_ENABLED = gc.isenabled()
+      gc.disable()
+    _GC_PAUSES += 1
+  try:
+    yield
+  finally:
+    with _GC_PAUSE_LOCK:
+      _GC_PAUSES -= 1
+      if _GC_PAUSES == 0 and _GC_WAS_ENABLED:
+        gc.enable()
 
 @quoll.config.show_python
 def translate(source: str, path: str) -> AST:
-  module = ast.parse(source)
-  context = TranslationContext()
-  BodyTranslator(context).visit(module)
-  return module
\ No newline at end of file
+  with _gc_paused():
+    module = ast.parse(source)
+    context = TranslationContext()
+    BodyTranslator(context).visit(module)
+    return fix_missing_locations(module)
\ No newline at end of file
@@ -13,6 +13,7 @@ classical programming and saving tons of boilerplate code.''',
     'abm',
     'qiskit-terra',
     'qiskit-ibmq-provider',
-    'astpretty'
+    'astpretty',
+    'numpy'
   ]
 )
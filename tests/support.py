@@ -0,0 +1,41 @@
+"""
+Shared setup of the test cases. Circuits run on the built-in statevector
+backend in exact mode, so probabilities can be compared with tight deltas.
+"""
+import os
+import tempfile
+import unittest
+
+import quoll.config
+from quoll.transpiler import translate
+
+_EXACT_CONFIG = '''
+[backend]
+default=quoll:statevector
+
+[backend:*]
+exact=true
+'''
+
+
+class QuollTestCase(unittest.TestCase):
+
+  config = _EXACT_CONFIG
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'quoll.ini')
+    with open(path, 'w') as file_:
+      file_.write(self.config)
+
+    previous = quoll.config.get_config_file()
+    quoll.config.set_config_file(path)
+    self.addCleanup(quoll.config.set_config_file, previous)
+
+
+def load_quoll(source: str) -> dict:
+  """Translate and run the Quoll `source`, returning its globals."""
+  namespace = {'__name__': '__quoll_test__'}
+  exec(compile(translate(source, '<test>'), '<test>', 'exec'), namespace)
+  return namespace
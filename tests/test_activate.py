@@ -0,0 +1,94 @@
+import ast
+import os
+import sys
+import tempfile
+import unittest
+from importlib import import_module, invalidate_caches
+
+from quoll.activate import CellTranslator
+
+from support import QuollTestCase
+
+CELL = '''
+with allocation(1) as (q,):
+  H(q)
+  result = measure(q)
+'''
+
+
+class CellTranslatorTest(unittest.TestCase):
+
+  def test_reruns_get_independent_trees(self):
+    translator = CellTranslator()
+    first = translator.visit(ast.parse(CELL))
+    expected = ast.dump(first)
+    first.body.clear()
+
+    second = translator.visit(ast.parse(CELL))
+    self.assertIsNot(second, first)
+    self.assertEqual(ast.dump(second), expected)
+
+
+MODULE = '''
+from quoll.preamble import *
+
+VALUE = {value}
+
+@qdef(adj=True)
+def flip(q):
+  X(q)
+'''
+
+
+class TranslationCacheTest(QuollTestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.cache_directory = os.path.join(directory.name, 'cache')
+    self.config = self.config + f'''
+[translation_cache]
+enabled=true
+directory={self.cache_directory}
+'''
+    super().setUp()
+
+    # Without bytecode, every import goes through the translation cache.
+    self.addCleanup(setattr, sys, 'dont_write_bytecode', sys.dont_write_bytecode)
+    sys.dont_write_bytecode = True
+    sys.path.insert(0, directory.name)
+    self.addCleanup(sys.path.remove, directory.name)
+    self.path = os.path.join(directory.name, 'cached_module.qll')
+
+  def _import(self, value: int, mtime: int):
+    with open(self.path, 'w') as file_:
+      file_.write(MODULE.format(value=value))
+    os.utime(self.path, (mtime, mtime))
+    sys.modules.pop('cached_module', None)
+    invalidate_caches()
+    return import_module('cached_module')
+
+  def _entries(self):
+    return sorted(
+      name for name in os.listdir(self.cache_directory) if name.endswith('.code'))
+
+  def test_edited_sources_are_translated_again(self):
+    self.addCleanup(sys.modules.pop, 'cached_module', None)
+    self.assertEqual(self._import(1, mtime=1000).VALUE, 1)
+    entries = self._entries()
+    self.assertEqual(len(entries), 1)
+
+    self.assertEqual(self._import(1, mtime=1000).VALUE, 1)
+    self.assertEqual(self._entries(), entries)
+
+    # Same size and modification time, different contents.
+    self.assertEqual(self._import(2, mtime=1000).VALUE, 2)
+    self.assertEqual(len(self._entries()), 2)
+
+    # Same contents, touched.
+    self.assertEqual(self._import(2, mtime=2000).VALUE, 2)
+    self.assertEqual(len(self._entries()), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
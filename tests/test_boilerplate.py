@@ -0,0 +1,136 @@
+import asyncio
+import time
+import unittest
+
+import quoll.config
+import quoll.boilerplate as bp
+from quoll.preamble import *
+from quoll.assertions import assertProb
+from quoll.simulator import StatevectorSimulator
+from qiskit.providers.jobstatus import JobStatus
+
+from support import QuollTestCase
+
+QUEUE_LATENCY = 0.2
+
+
+class _QueuedJob:
+  """Job waiting in a remote queue for `latency` seconds."""
+
+  def __init__(self, job, latency: float):
+    self._job = job
+    self._ready_at = time.monotonic() + latency
+
+  def status(self) -> JobStatus:
+    if time.monotonic() < self._ready_at:
+      return JobStatus.QUEUED
+    return self._job.status()
+
+  def result(self):
+    time.sleep(max(0, self._ready_at - time.monotonic()))
+    return self._job.result()
+
+
+class _QueuedBackend:
+
+  name = 'queued'
+
+  def __init__(self, latency: float):
+    self._latency = latency
+    self._simulator = StatevectorSimulator()
+    self.submissions = 0
+
+  def run_circuits(self, circuits, options):
+    self.submissions += 1
+    return _QueuedJob(self._simulator.run_circuits(circuits, options), self._latency)
+
+
+class _QueuedProvider:
+
+  def __init__(self, latency: float = QUEUE_LATENCY):
+    self.backend = _QueuedBackend(latency)
+
+  def get_backend(self, name):
+    return self.backend
+
+
+class ExecuteAsyncTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    provider = _QueuedProvider()
+    self.backend = provider.backend
+    quoll.config.register_provider('queued', lambda: provider)
+    quoll.config.set_backend('queued:statevector')
+    self.addCleanup(quoll.config.set_backend, None)
+
+  def test_allocations_wait_for_the_queue_concurrently(self):
+    async def flip(index: int):
+      async with allocation(1) as (q,):
+        if index % 2:
+          X(q)
+        (outcome,) = await bp.execute_async(measure(q), poll_interval=0.01)
+        return bool(outcome)
+
+    async def flip_all():
+      return await asyncio.gather(*(flip(index) for index in range(8)))
+
+    start = time.monotonic()
+    outcomes = asyncio.run(flip_all())
+    elapsed = time.monotonic() - start
+
+    self.assertEqual(outcomes, [bool(index % 2) for index in range(8)])
+    self.assertEqual(self.backend.submissions, 8)
+    self.assertLess(elapsed, 4 * QUEUE_LATENCY)
+
+  def test_outcomes_are_exact(self):
+    async def bell():
+      async with allocation(1, 1) as (c, t):
+        H(c)
+        Controlled[X](c, t)
+        return await bp.execute_async(measure(c), measure(t), poll_interval=0.01)
+
+    c, t = asyncio.run(bell())
+    assertProb([c, t], [1, 1], prob=0.5, delta=1E-9)
+
+
+class BatchTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    provider = _QueuedProvider(latency=0)
+    self.backend = provider.backend
+    quoll.config.register_provider('queued', lambda: provider)
+    quoll.config.set_backend('queued:statevector')
+    self.addCleanup(quoll.config.set_backend, None)
+
+  def _prepare(self, value: int):
+    with allocation(2) as (q,):
+      for position in range(2):
+        if value >> position & 1:
+          X(q[position])
+      (outcome,) = bp.execute(measure(q))
+    return outcome
+
+  def test_allocations_are_submitted_together(self):
+    with batch():
+      outcomes = [self._prepare(value) for value in range(4)]
+      self.assertEqual(self.backend.submissions, 0)
+      self.assertEqual([int(outcome) for outcome in outcomes], [0, 1, 2, 3])
+      self.assertEqual(self.backend.submissions, 1)
+
+      # Allocations after reading the results go in a new submission.
+      outcome = self._prepare(3)
+    self.assertEqual(self.backend.submissions, 2)
+    self.assertEqual(int(outcome), 3)
+
+  def test_leaving_the_batch_submits_pending_allocations(self):
+    with batch():
+      outcomes = [self._prepare(value) for value in range(3)]
+    self.assertEqual(self.backend.submissions, 1)
+    self.assertEqual([int(outcome) for outcome in outcomes], [0, 1, 2])
+    self.assertEqual(self.backend.submissions, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
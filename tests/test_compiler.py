@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from importlib.util import cache_from_source
+from io import StringIO
+
+from quoll.cli import compile_main
+from quoll.compiler import compile_paths
+
+from support import QuollTestCase
+
+SOURCE = '''
+from quoll.preamble import *
+
+@qdef(adj=True)
+def bell(c, t):
+  H(c)
+  Controlled[X](c, t)
+'''
+
+
+class CompileTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.path = os.path.join(directory.name, 'bell_compiled.qll')
+    with open(self.path, 'w') as file_:
+      file_.write(SOURCE)
+    self.missing = os.path.join(directory.name, 'missing')
+
+  def test_writes_bytecode_once(self):
+    first, = compile_paths([self.path], workers=1)
+    self.assertIsNone(first.error)
+    self.assertTrue(first.compiled)
+    self.assertTrue(os.path.isfile(cache_from_source(self.path)))
+
+    second, = compile_paths([self.path], workers=1)
+    self.assertFalse(second.compiled)
+
+    forced, = compile_paths([self.path], force=True, workers=1)
+    self.assertTrue(forced.compiled)
+
+  def test_reports_missing_paths(self):
+    result, = compile_paths([self.missing], workers=1)
+    self.assertFalse(result.compiled)
+    self.assertIn('FileNotFoundError', result.error)
+
+  def test_cli_fails_on_missing_paths(self):
+    with redirect_stdout(StringIO()), redirect_stderr(StringIO()) as errors:
+      status = compile_main([self.path, self.missing, '-c', ''])
+    self.assertEqual(status, 1)
+    self.assertIn(self.missing, errors.getvalue())
+
+
+if __name__ == '__main__':
+  unittest.main()
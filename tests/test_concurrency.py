@@ -0,0 +1,64 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import quoll.boilerplate as bp
+from quoll.preamble import *
+
+from support import QuollTestCase
+
+ALLOCATIONS = 320
+
+
+def _build(index: int):
+  """Flip the qubits of ``index`` in a register of its own size, yielding
+  between gates so other threads interleave their operations."""
+  size = 1 + index % 5
+  pattern = index % 2**size
+  with allocation(size) as (register,):
+    for position in range(size):
+      if pattern >> position & 1:
+        X(register[position])
+      time.sleep(0)
+    circuit = bp.current_allocation().circuit
+    gates = len(circuit.data)
+    (outcome,) = bp.execute(measure(register))
+    return circuit.num_qubits, gates, int(outcome)
+
+def _expected(index: int):
+  size = 1 + index % 5
+  pattern = index % 2**size
+  return size, bin(pattern).count('1'), pattern
+
+
+class ConcurrentAllocationsTest(QuollTestCase):
+
+  def test_threads_build_isolated_circuits(self):
+    with ThreadPoolExecutor(16) as executor:
+      results = list(executor.map(_build, range(ALLOCATIONS)))
+    self.assertEqual(results, [_expected(index) for index in range(ALLOCATIONS)])
+
+  def test_tasks_build_isolated_circuits(self):
+    async def build(index: int):
+      size = 1 + index % 5
+      pattern = index % 2**size
+      async with allocation(size) as (register,):
+        for position in range(size):
+          if pattern >> position & 1:
+            X(register[position])
+          await asyncio.sleep(0)
+        circuit = bp.current_allocation().circuit
+        gates = len(circuit.data)
+        (outcome,) = await bp.execute_async(measure(register), poll_interval=0)
+        return circuit.num_qubits, gates, int(outcome)
+
+    async def build_all():
+      return await asyncio.gather(*(build(index) for index in range(ALLOCATIONS)))
+
+    results = asyncio.run(build_all())
+    self.assertEqual(results, [_expected(index) for index in range(ALLOCATIONS)])
+
+
+if __name__ == '__main__':
+  unittest.main()
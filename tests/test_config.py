@@ -0,0 +1,39 @@
+import unittest
+
+import quoll.config
+
+from support import QuollTestCase
+
+
+class _Provider:
+
+  def get_backend(self, name):
+    # A new backend object on every call.
+    return (self, name)
+
+
+class BackendResolutionTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    quoll.config.set_backend('fake:simulator')
+    self.addCleanup(quoll.config.set_backend, None)
+
+  def test_registering_a_provider_again_replaces_its_backends(self):
+    first, second = _Provider(), _Provider()
+    quoll.config.register_provider('fake', lambda: first)
+    self.assertIs(quoll.config.get_backend()[0], first)
+    quoll.config.register_provider('fake', lambda: second)
+    self.assertIs(quoll.config.get_backend()[0], second)
+
+  def test_reload_resolves_backends_again(self):
+    provider = _Provider()
+    quoll.config.register_provider('fake', lambda: provider)
+    backend = quoll.config.get_backend()
+    self.assertIs(quoll.config.get_backend(), backend)
+    quoll.config.reload()
+    self.assertIsNot(quoll.config.get_backend(), backend)
+
+
+if __name__ == '__main__':
+  unittest.main()
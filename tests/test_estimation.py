@@ -0,0 +1,49 @@
+import unittest
+
+import quoll.boilerplate as bp
+from quoll.preamble import *
+from quoll.estimation import estimate, format_memory
+
+from support import QuollTestCase
+
+
+def _cancelling_program():
+  with allocation(1) as (q,):
+    X(q)
+    X(q)
+    H(q)
+    bp.execute(measure(q))
+
+
+class EstimateTest(QuollTestCase):
+
+  config = '''
+[backend]
+default=quoll:statevector
+
+[backend:*]
+optimize=true
+'''
+
+  def test_reports_emitted_and_optimized_resources(self):
+    circuit_estimate, = estimate(_cancelling_program)
+    self.assertEqual(circuit_estimate.emitted.gate_counts['x'], 2)
+    self.assertNotIn('x', circuit_estimate.optimized.gate_counts)
+    self.assertEqual(circuit_estimate.optimized.gate_counts['h'], 1)
+    self.assertNotIn('x', circuit_estimate.transpiled.gate_counts)
+
+
+class FormatMemoryTest(unittest.TestCase):
+
+  def test_formats_units(self):
+    self.assertEqual(format_memory(512), '512 B')
+    self.assertEqual(format_memory(1536), '1.5 KiB')
+    self.assertEqual(format_memory(16 * 2**30), '16 GiB')
+
+  def test_formats_sizes_beyond_floats(self):
+    self.assertEqual(format_memory(16 * 2**2000), '2^2004 B')
+    self.assertEqual(format_memory(3 * 2**2000), '1.5*2^2001 B')
+
+
+if __name__ == '__main__':
+  unittest.main()
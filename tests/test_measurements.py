@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+import quoll.config
+import quoll.boilerplate as bp
+from quoll.assertions import assertProb
+from quoll.measurements import OutcomeTable
+from quoll.preamble import *
+
+from support import QuollTestCase
+
+# Registers of 1, 3 and 2 bits. Qiskit prints the first register on the
+# right: 0b10 | 0b011 | 0b1.
+COUNTS = {'10 011 1': 600, '01 011 0': 300, '00 100 1': 100}
+
+SIZES = [1, 3, 2]
+
+
+class OutcomeTableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.table = OutcomeTable.from_counts(COUNTS, SIZES)
+
+  def test_reads_each_register_from_its_bits(self):
+    self.assertEqual(self.table.values(0).tolist(), [1, 0, 1])
+    self.assertEqual(self.table.values(1).tolist(), [3, 3, 4])
+    self.assertEqual(self.table.values(2).tolist(), [2, 1, 0])
+    self.assertEqual(
+      [self.table.most_likely(index) for index in range(3)], [1, 3, 2])
+
+  def test_marginalises_over_the_other_registers(self):
+    self.assertEqual(self.table.marginal(0), {0: 0.3, 1: 0.7})
+    self.assertEqual(self.table.marginal(1), {3: 0.9, 4: 0.1})
+    self.assertEqual(self.table.marginal(2), {0: 0.1, 1: 0.3, 2: 0.6})
+    self.assertAlmostEqual(self.table.probability({0: 1, 1: 3}), 0.6)
+    self.assertAlmostEqual(self.table.probability({2: 0, 0: 1}), 0.1)
+    self.assertAlmostEqual(self.table.probability({1: 3}), 0.9)
+
+  def test_samples_repeat_each_outcome_by_its_counts(self):
+    samples = self.table.samples(2)
+    self.assertEqual(len(samples), 1000)
+    self.assertEqual(np.bincount(samples).tolist(), [100, 300, 600])
+
+  def test_wide_memories_keep_python_integers(self):
+    wide = OutcomeTable.from_counts({'1' + '0' * 69 + ' 1': 1}, [1, 70])
+    self.assertEqual(wide.outcomes.dtype, object)
+    self.assertEqual(wide.most_likely(0), 1)
+    self.assertEqual(wide.most_likely(1), 2**69)
+
+
+class MeasurementRegistersTest(QuollTestCase):
+
+  def _measure_registers(self):
+    with allocation(1, 3, 2) as (first, second, third):
+      X(first)
+      X(second[0])
+      X(second[1])
+      H(third[1])
+      return bp.execute(measure(first), measure(second), measure(third))
+
+  def _check(self, exact: bool):
+    first, second, third = self._measure_registers()
+    self.assertEqual(first.execution.outcomes.exact, exact)
+    self.assertEqual((int(first), int(second)), (1, 3))
+    self.assertIn(int(third), (0, 2))
+    self.assertEqual(first.marginal(), {1: 1.0})
+    self.assertEqual(second.marginal(), {3: 1.0})
+    self.assertEqual(set(third.marginal()), {0, 2})
+    assertProb([first, second], [1, 3], prob=1, delta=1E-9)
+    assertProb([third, first], [2, 1], prob=0.5, delta=0.1)
+    with self.assertRaises(AssertionError):
+      assertProb([second, third], [3, 1], prob=0.5, delta=0.1)
+
+  def test_exact_outcomes(self):
+    self._check(exact=True)
+
+  def test_sampled_counts(self):
+    quoll.config.set_backend('basicaer:qasm_simulator')
+    self.addCleanup(quoll.config.set_backend, None)
+    self._check(exact=False)
+
+
+if __name__ == '__main__':
+  unittest.main()
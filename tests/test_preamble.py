@@ -0,0 +1,136 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import quoll.boilerplate as bp
+from quoll.preamble import *
+from quoll.assertions import assertProb
+
+from support import QuollTestCase
+
+
+class ZeroWidthControlTest(QuollTestCase):
+
+  def test_controlled_z_on_one_database_qubit(self):
+    # The reflection of the Grover samples with one database qubit.
+    with allocation(1) as (db_register,):
+      H(db_register)
+      Controlled[Z](db_register[1:], db_register[0])
+      H(db_register)
+      (outcome,) = bp.execute(measure(db_register))
+      assertProb([outcome], [1], prob=1, delta=1E-9)
+
+  def test_controlled_x_and_h_apply_the_bare_gate(self):
+    with allocation(1, 1) as (empty_source, target):
+      Controlled[X](empty_source[1:], target)
+      Controlled[H](empty_source[1:], target)
+      Controlled[H](empty_source[1:], target)
+      (outcome,) = bp.execute(measure(target))
+      assertProb([outcome], [1], prob=1, delta=1E-9)
+
+
+
+@qdef(cache=True)
+def _controlled_flip(control, q):
+  Controlled[X](control, q)
+
+@qdef(cache=True)
+def _bell(c, t):
+  H(c)
+  Controlled[X](c, t)
+
+
+class CachedOperationTest(QuollTestCase):
+
+  def test_controls_as_arguments_run_uncached(self):
+    for state in range(4):
+      with allocation(1, 1, 1) as (a, b, target):
+        if state & 1:
+          X(a)
+        if state & 2:
+          X(b)
+        _controlled_flip(a & b, target)
+        (outcome,) = bp.execute(measure(target))
+        assertProb([outcome], [state == 3], prob=1, delta=1E-9)
+
+  def test_gates_are_shared_across_threads(self):
+    def run_bell(_):
+      with allocation(1, 1) as (c, t):
+        _bell(c, t)
+        return len(bp.current_allocation().circuit.data)
+
+    with ThreadPoolExecutor(8) as executor:
+      sizes = list(executor.map(run_bell, range(200)))
+    self.assertEqual(sizes, [1] * 200)
+
+
+
+class AncillaTest(QuollTestCase):
+
+  def _last_qubits(self):
+    _, qargs, _ = bp.current_allocation().circuit.data[-1]
+    return qargs
+
+  def test_lends_only_clean_ancilla_to_multi_controlled_gates(self):
+    with allocation(5, 1) as (controls, target):
+      with ancilla(1) as (dirty,):
+        X(dirty)
+      Controlled[X](controls, target)
+      self.assertNotIn(dirty.qiskit_qubits[0], self._last_qubits())
+
+      with ancilla(1, reset=True) as (reset,):
+        X(reset)
+      Controlled[X](controls, target)
+      self.assertIn(reset.qiskit_qubits[0], self._last_qubits())
+
+  def test_check_ignores_operations_before_the_block(self):
+    with allocation(1, 1) as (control, target):
+      H(control)
+      bp.current_allocation().circuit.reset(control.qiskit_qubits)
+      H(control)
+      with ancilla(1, check=True) as (tmp,):
+        Controlled[X](control, tmp)
+        Controlled[X](tmp, target)
+        Controlled[X](control, tmp)
+
+  def test_check_holds_for_any_state_of_the_other_qubits(self):
+    with allocation(1) as (control,):
+      # The control is |0> here, but the block does not uncompute others.
+      with self.assertRaises(AssertionError):
+        with ancilla(1, check=True) as (tmp,):
+          Controlled[X](control, tmp)
+
+  def test_check_defers_measurements(self):
+    with allocation(1) as (control,):
+      H(control)
+      with self.assertRaises(AssertionError):
+        with ancilla(1, check=True) as (tmp,):
+          Controlled[X](control, tmp)
+          bp.current_allocation().circuit.measure_all()
+          H(control)
+          Controlled[X](control, tmp)
+
+
+
+class QubitsEqualityTest(unittest.TestCase):
+
+  def test_views_are_equal_when_they_are_the_same_qubits(self):
+    with allocation(3, 3) as (a, b):
+      self.assertEqual(a[1:], a[1:3])
+      self.assertEqual(hash(a[1:]), hash(a[1:3]))
+      self.assertNotEqual(a, b)
+      self.assertIn(b, [a, b])
+      self.assertEqual([a, b].index(b), 1)
+      self.assertEqual(len({a, a[:], b}), 2)
+      self.assertEqual({a: 'a', b: 'b'}[b[:]], 'b')
+
+  def test_comparing_registers_by_value_is_explicit(self):
+    with allocation(2, 2, 3) as (a, b, c):
+      self.assertIsInstance(a.equals(b), RegisterComparison)
+      self.assertIsInstance(bp.compare(a, b), RegisterComparison)
+      self.assertIsInstance(bp.compare(1, a), QComparison)
+      with self.assertRaises(ValueError):
+        a.equals(c)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+from qiskit.circuit import Parameter
+
+import quoll.boilerplate as bp
+from quoll.config import BackendOptions
+from quoll.measurements import OutcomeTable
+from quoll.preamble import *
+from quoll.result_cache import ResultCache, get_result_cache
+
+from support import QuollTestCase
+
+
+def _bell(qname='q', cname='c', angle=None) -> QuantumCircuit:
+  qubits, clbits = QuantumRegister(2, qname), ClassicalRegister(2, cname)
+  circuit = QuantumCircuit(qubits, clbits)
+  circuit.h(qubits[0])
+  if angle is not None:
+    circuit.rx(angle, qubits[1])
+  circuit.cx(qubits[0], qubits[1])
+  circuit.measure(qubits, clbits)
+  return circuit
+
+def _table(value: int) -> OutcomeTable:
+  return OutcomeTable(
+    np.array([value], dtype=np.int64), np.array([1.0]), [2], exact=True)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+
+  def _cache(self, memory_size=4, max_size=2**20) -> ResultCache:
+    return ResultCache(memory_size, self.directory, max_size)
+
+  def test_keys_ignore_register_names(self):
+    cache, options = self._cache(), BackendOptions()
+    key = cache.key(_bell(), 'quoll:statevector', options)
+    self.assertEqual(key, cache.key(_bell('r', 'm'), 'quoll:statevector', options))
+    self.assertNotEqual(key, cache.key(_bell(angle=0.5), 'quoll:statevector', options))
+    self.assertNotEqual(key, cache.key(_bell(), 'basicaer:qasm_simulator', options))
+    self.assertNotEqual(key, cache.key(_bell(), 'quoll:statevector', BackendOptions(shots=1)))
+
+  def test_circuits_with_unbound_parameters_have_no_key(self):
+    circuit = _bell(angle=Parameter('theta'))
+    self.assertIsNone(self._cache().key(circuit, 'quoll:statevector', BackendOptions()))
+
+  def test_results_are_kept_in_memory_and_on_disk(self):
+    cache = self._cache()
+    self.assertIsNone(cache.get('bell'))
+    cache.put('bell', _table(3))
+    self.assertEqual(cache.get('bell').outcomes.tolist(), [3])
+
+    other = self._cache()
+    self.assertEqual(other.get('bell').outcomes.tolist(), [3])
+    self.assertEqual(other.get('bell').outcomes.tolist(), [3])
+    self.assertEqual(
+      (cache.statistics.memory_hits, cache.statistics.misses, cache.statistics.stores),
+      (1, 1, 1))
+    self.assertEqual(
+      (other.statistics.disk_hits, other.statistics.memory_hits), (1, 1))
+    self.assertEqual(other.statistics.hit_rate, 1.0)
+
+  def test_memory_evicts_the_least_recently_used_results(self):
+    cache = self._cache(memory_size=2)
+    for key, value in (('first', 0), ('second', 1)):
+      cache.put(key, _table(value))
+    cache.get('first')
+    cache.put('third', _table(2))
+
+    # The second result was evicted, and reading it evicts the first one.
+    cache.get('second')
+    self.assertEqual(cache.statistics.disk_hits, 1)
+    cache.get('third')
+    cache.get('second')
+    self.assertEqual(cache.statistics.memory_hits, 3)
+    cache.get('first')
+    self.assertEqual(cache.statistics.disk_hits, 2)
+
+  def test_disk_evicts_the_least_recently_used_results(self):
+    cache = self._cache(memory_size=0)
+    cache.put('first', _table(0))
+    entry_size = os.path.getsize(os.path.join(self.directory, 'first.npz'))
+    cache.max_size = 2 * entry_size
+    os.utime(os.path.join(self.directory, 'first.npz'), (0, 0))
+    cache.put('second', _table(1))
+    cache.put('third', _table(2))
+    self.assertEqual(
+      sorted(os.listdir(self.directory)), ['second.npz', 'third.npz'])
+    self.assertIsNone(cache.get('first'))
+
+  def test_threads_share_the_memory_tier(self):
+    cache = self._cache(memory_size=2)
+    def use(index: int):
+      key = f'entry{index % 5}'
+      if cache.get(key) is None:
+        cache.put(key, _table(index % 4))
+
+    with ThreadPoolExecutor(8) as executor:
+      list(executor.map(use, range(2000)))
+    statistics = cache.statistics
+    self.assertEqual(statistics.hits + statistics.misses, 2000)
+    self.assertLessEqual(len(cache._memory), 2)
+
+
+class ExecutionCacheTest(QuollTestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.config = self.config + f'''
+[result_cache]
+enabled=true
+directory={directory.name}
+'''
+    super().setUp()
+
+  def test_identical_allocations_reuse_results(self):
+    cache = get_result_cache()
+    for _ in range(3):
+      with allocation(1, 1) as (c, t):
+        H(c)
+        Controlled[X](c, t)
+        (outcome,) = bp.execute(measure(c + t))
+        self.assertEqual(outcome.marginal(), {0: 0.5, 3: 0.5})
+    self.assertEqual(
+      (cache.statistics.misses, cache.statistics.stores, cache.statistics.hits),
+      (1, 1, 2))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,299 @@
+import gc
+import unittest
+
+from quoll.preamble import *
+from quoll.assertions import assertProb
+
+import quoll.boilerplate as bp
+from quoll.transpiler import translate
+from quoll.unparser import unparse
+
+from support import QuollTestCase, load_quoll
+
+
+class GarbageCollectorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.addCleanup(gc.enable if gc.isenabled() else gc.disable)
+
+  def test_translation_keeps_the_collector_enabled(self):
+    gc.enable()
+    translate('from quoll.preamble import *\n', '<test>')
+    self.assertTrue(gc.isenabled())
+
+  def test_translation_keeps_the_collector_disabled(self):
+    gc.disable()
+    translate('from quoll.preamble import *\n', '<test>')
+    self.assertFalse(gc.isenabled())
+
+  def test_failed_translation_restores_the_collector(self):
+    gc.enable()
+    with self.assertRaises(SyntaxError):
+      translate('def broken(:\n', '<test>')
+    self.assertTrue(gc.isenabled())
+
+
+
+LOOPS = '''
+from quoll.preamble import *
+
+calls = []
+
+@qdef(adj=True, ctl=True)
+def flips(q, count):
+  for _ in range(count):
+    H(q)
+    X(q)
+
+@qdef(adj=True, ctl=True)
+def rotations(q, count):
+  for step in range(count):
+    R1(step, q)
+    H(q)
+
+@qdef
+def record(q):
+  calls.append(q)
+  X(q)
+
+def flip_empty(q):
+  for _ in range(0):
+    X(q)
+
+def flip_each(q, count):
+  for _ in range(count):
+    record(q)
+
+@qdef(adj=True, pure=True)
+def reflect(q):
+  H(q)
+  Z(q)
+
+class Search:
+
+  @qdef(pure=True)
+  def step(self, q):
+    reflect(q)
+    Adjoint[reflect](q)
+    X(q)
+
+  def run(self, q, count):
+    for _ in range(count):
+      self.step(q)
+      Adjoint[reflect](q)
+'''
+
+
+class LoopLiftingTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.module = load_quoll(LOOPS)
+
+  def _gates(self, circuit):
+    return [instruction.name for instruction, _, _ in circuit.data]
+
+  def test_lifts_loops_of_gates_into_one_repeated_gate(self):
+    with allocation(1) as (q,):
+      self.module['flips'](q, 100)
+      circuit = bp.current_allocation().circuit
+      self.assertEqual(self._gates(circuit), ['h', 'x', 'loop*99'])
+
+  def test_does_not_evaluate_operations_of_empty_loops(self):
+    self.assertIn('bp.repeat(range(0)', unparse(translate(LOOPS, '<test>')))
+    evaluated = []
+    def operations():
+      evaluated.append(True)
+      return (X,)
+
+    with allocation(1) as (q,):
+      self.module['flip_empty'](q)
+      self.assertEqual(list(bp.repeat(range(0), operations)), [])
+      self.assertEqual(list(bp.repeat(range(1), operations)), [0])
+      self.assertEqual(bp.current_allocation().circuit.data, [])
+    self.assertEqual(evaluated, [])
+
+  def test_runs_other_operations_on_every_iteration(self):
+    with allocation(1) as (q,):
+      self.module['flip_each'](q, 3)
+      circuit = bp.current_allocation().circuit
+    self.assertEqual(len(self.module['calls']), 3)
+    self.assertEqual(self._gates(circuit), ['x', 'x', 'x'])
+
+  def test_lifts_loops_of_pure_operations(self):
+    with allocation(1) as (q,):
+      self.module['Search']().run(q, 5)
+      circuit = bp.current_allocation().circuit
+      self.assertEqual(self._gates(circuit), ['h', 'z', 'z', 'h', 'x', 'z', 'h', 'loop*4'])
+      # Each iteration applies X, Z and H.
+      for _ in range(5):
+        H(q)
+        Z(q)
+        X(q)
+      (outcome,) = bp.execute(measure(q))
+      assertProb([outcome], [0], prob=1, delta=1E-9)
+
+  def test_variants_iterate_the_original_range(self):
+    python = unparse(translate(LOOPS, '<test>'))
+    self.assertNotIn('Adjoint[range]', python)
+    self.assertNotIn('Controlled[range]', python)
+
+  def test_adjoint_undoes_the_iterations_in_reverse(self):
+    for operation in ('flips', 'rotations'):
+      with allocation(1) as (q,):
+        H(q)
+        self.module[operation](q, 3)
+        Adjoint[self.module[operation]](q, 3)
+        H(q)
+        (outcome,) = bp.execute(measure(q))
+        assertProb([outcome], [0], prob=1, delta=1E-9)
+
+
+
+CASES = '''
+from quoll.preamble import *
+
+@qdef(adj=True)
+def branches(register, target):
+  if superposition(register == 0):
+    H(target)
+    R1(0.3, target)
+  elif superposition(register == 1):
+    RX(0.5, target)
+    H(target)
+  else:
+    H(target)
+    RX(0.7, target)
+    Z(target)
+
+@qdef(adj=True)
+def controlled_block(register, target):
+  if superposition(register == 3):
+    H(target)
+    R1(0.3, target)
+    RX(0.5, target)
+
+def nested_cases(outer, inner, target):
+  if superposition(outer == 0):
+    if superposition(inner == 0):
+      X(target)
+    else:
+      H(target)
+  elif superposition(outer == 1):
+    X(target)
+
+@qdef(ctl=True, cache=True)
+def cached_cases(register, target):
+  if superposition(register == 0):
+    X(target)
+  elif superposition(register == 1):
+    H(target)
+  else:
+    Z(target)
+
+def empty_case(register, target):
+  if superposition(register == 0):
+    pass
+  else:
+    X(target)
+
+def empty_case_of_many(register, target):
+  if superposition(register == 0):
+    pass
+  elif superposition(register == 1):
+    X(target)
+  else:
+    X(target)
+
+def compare_registers(left, right, target):
+  if superposition(left == right):
+    X(target)
+  else:
+    H(target)
+    Z(target)
+    H(target)
+'''
+
+
+class QuantumIfTest(QuollTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.module = load_quoll(CASES)
+
+  def test_adjoint_undoes_branches_of_several_statements(self):
+    for operation in ('branches', 'controlled_block'):
+      for value in range(4):
+        with allocation(2, 1) as (register, target):
+          for position in range(2):
+            if value >> position & 1:
+              X(register[position])
+          self.module[operation](register, target)
+          Adjoint[self.module[operation]](register, target)
+          (outcome,) = bp.execute(measure(target))
+          assertProb([outcome], [0], prob=1, delta=1E-9)
+
+  def test_multiplexors_keep_their_phase_inside_branches(self):
+    # Both branches flip the target, so the outer qubit stays in |+>.
+    with allocation(1, 1, 1) as (outer, inner, target):
+      H(outer)
+      self.module['nested_cases'](outer, inner, target)
+      H(outer)
+      (outcome,) = bp.execute(measure(outer))
+      assertProb([outcome], [0], prob=1, delta=1E-9)
+
+  def test_multiplexors_keep_their_phase_when_controlled(self):
+    # The target is an eigenstate, with eigenvalue 1, of the gate applied.
+    for value, target_preparation in ((0, H), (3, None)):
+      with allocation(1, 2, 1) as (control, register, target):
+        for position in range(2):
+          if value >> position & 1:
+            X(register[position])
+        if target_preparation:
+          target_preparation(target)
+        H(control)
+        Controlled[self.module['cached_cases']](control, register, target)
+        H(control)
+        (outcome,) = bp.execute(measure(control))
+        assertProb([outcome], [0], prob=1, delta=1E-9)
+
+  def test_empty_cases_do_not_take_the_else_branch(self):
+    for operation, size in (('empty_case', 1), ('empty_case_of_many', 2)):
+      for value in range(2**size):
+        with allocation(size, 1) as (register, target):
+          for position in range(size):
+            if value >> position & 1:
+              X(register[position])
+          self.module[operation](register, target)
+          (outcome,) = bp.execute(measure(target))
+          assertProb([outcome], [int(value != 0)], prob=1, delta=1E-9)
+
+  def test_else_clause_after_register_comparison(self):
+    for left_value in range(4):
+      for right_value in range(4):
+        with allocation(2, 2, 1) as (left, right, target):
+          for register, value in ((left, left_value), (right, right_value)):
+            for position in range(2):
+              if value >> position & 1:
+                X(register[position])
+          self.module['compare_registers'](left, right, target)
+          (outcome,) = bp.execute(measure(target))
+          assertProb([outcome], [1], prob=1, delta=1E-9)
+
+  def test_elif_clauses_cannot_compare_registers(self):
+    module = load_quoll('''
+from quoll.preamble import *
+
+def compare(left, right, target):
+  if superposition(left == right):
+    X(target)
+  elif superposition(left == 0):
+    H(target)
+''')
+    with allocation(2, 2, 1) as (left, right, target):
+      with self.assertRaisesRegex(TypeError, 'elif clauses cannot compare two registers'):
+        module['compare'](left, right, target)
+
+
+if __name__ == '__main__':
+  unittest.main()